@@ -0,0 +1,34 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицы, а CONCURRENTLY нельзя выполнить в транзакции
+    atomic = False
+
+    dependencies = [
+        ("movies", "0001_initial"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="filmwork",
+            index=models.Index(fields=["modified", "id"], name="film_work_modified_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="genre",
+            index=models.Index(fields=["modified", "id"], name="genre_modified_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="person",
+            index=models.Index(fields=["modified", "id"], name="person_modified_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="genrefilmwork",
+            index=models.Index(fields=["genre"], include=["film_work"], name="genre_film_work_genre_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="personfilmwork",
+            index=models.Index(fields=["person"], include=["film_work", "role"], name="person_film_work_person_idx"),
+        ),
+    ]
@@ -0,0 +1,138 @@
+from django.db import migrations
+
+# Документ фильма для индекса movies: фильм с персонами по ролям и жанрами
+FILM_WORK_DOCUMENT_VIEW = """
+    CREATE OR REPLACE VIEW content.film_work_document AS
+    SELECT
+        fw.id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.permissions,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)
+            ) FILTER (WHERE p.id is not null and pfw.role = 'actor'),
+            '[]'
+        ) as actors,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)
+            ) FILTER (WHERE p.id is not null and pfw.role = 'writer'),
+            '[]'
+        ) as writers,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)
+            ) FILTER (WHERE p.id is not null and pfw.role = 'director'),
+            '[]'
+        ) as directors,
+        array_agg(DISTINCT g.name) as genres
+    FROM content.film_work fw
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    GROUP BY fw.id;
+"""
+
+# Готовые документы фильмов. modified - время последней пересборки документа (UTC, как и в
+# остальных таблицах), поэтому изменение персоны или жанра сдвигает modified всех его фильмов,
+# и ETL читает таблицу простым диапазоном по индексу (modified, id).
+FILM_WORK_SEARCH_TABLE = """
+    CREATE TABLE content.film_work_search AS
+    SELECT d.*, fw.modified
+    FROM content.film_work_document d
+    JOIN content.film_work fw USING (id);
+
+    ALTER TABLE content.film_work_search ADD PRIMARY KEY (id);
+    ALTER TABLE content.film_work_search ALTER COLUMN modified SET DEFAULT (clock_timestamp() AT TIME ZONE 'UTC');
+    CREATE INDEX film_work_search_modified_idx ON content.film_work_search (modified, id);
+"""
+
+REFRESH_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.refresh_film_work_search(film_ids uuid[]) RETURNS void AS $$
+        DELETE FROM content.film_work_search WHERE id = ANY(film_ids);
+        INSERT INTO content.film_work_search (
+            id, title, description, rating, type, created, permissions, actors, writers, directors, genres
+        )
+        SELECT id, title, description, rating, type, created, permissions, actors, writers, directors, genres
+        FROM content.film_work_document
+        WHERE id = ANY(film_ids);
+    $$ LANGUAGE sql;
+"""
+
+# Пересборка затронутых документов в той же транзакции, что и изменение. Правка жанра
+# или персоны стоит столько, сколько у них фильмов.
+TRIGGER_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.film_work_search_changed() RETURNS trigger AS $$
+    DECLARE
+        changed record;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+
+        IF TG_TABLE_NAME = 'film_work' THEN
+            PERFORM content.refresh_film_work_search(ARRAY[changed.id]);
+        ELSIF TG_TABLE_NAME IN ('genre_film_work', 'person_film_work') THEN
+            IF TG_OP = 'UPDATE' THEN
+                PERFORM content.refresh_film_work_search(ARRAY[OLD.film_work_id, NEW.film_work_id]);
+            ELSE
+                PERFORM content.refresh_film_work_search(ARRAY[changed.film_work_id]);
+            END IF;
+        ELSIF TG_TABLE_NAME = 'genre' THEN
+            PERFORM content.refresh_film_work_search(
+                ARRAY(SELECT film_work_id FROM content.genre_film_work WHERE genre_id = changed.id)
+            );
+        ELSE
+            PERFORM content.refresh_film_work_search(
+                ARRAY(SELECT film_work_id FROM content.person_film_work WHERE person_id = changed.id)
+            );
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+WATCHED_TABLES = ("film_work", "genre", "person", "genre_film_work", "person_film_work")
+
+TRIGGERS = "".join(f"""
+    CREATE TRIGGER film_work_search_changed
+    AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+    FOR EACH ROW EXECUTE FUNCTION content.film_work_search_changed();
+""" for table in WATCHED_TABLES)
+
+DROP_TRIGGERS = "".join(
+    f"DROP TRIGGER IF EXISTS film_work_search_changed ON content.{table};" for table in WATCHED_TABLES
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0002_etl_indexes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=FILM_WORK_DOCUMENT_VIEW,
+            reverse_sql="DROP VIEW IF EXISTS content.film_work_document;",
+        ),
+        migrations.RunSQL(
+            sql=FILM_WORK_SEARCH_TABLE,
+            reverse_sql="DROP TABLE IF EXISTS content.film_work_search;",
+        ),
+        migrations.RunSQL(
+            sql=REFRESH_FUNCTION,
+            reverse_sql="DROP FUNCTION IF EXISTS content.refresh_film_work_search(uuid[]);",
+        ),
+        migrations.RunSQL(
+            sql=TRIGGER_FUNCTION + TRIGGERS,
+            reverse_sql=DROP_TRIGGERS + "DROP FUNCTION IF EXISTS content.film_work_search_changed();",
+        ),
+    ]
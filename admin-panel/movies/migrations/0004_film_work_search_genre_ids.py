@@ -0,0 +1,88 @@
+from django.db import migrations
+
+# Документ фильма дополняется id жанров (новая колонка view может быть только последней)
+FILM_WORK_DOCUMENT_VIEW = """
+    CREATE OR REPLACE VIEW content.film_work_document AS
+    SELECT
+        fw.id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.permissions,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)
+            ) FILTER (WHERE p.id is not null and pfw.role = 'actor'),
+            '[]'
+        ) as actors,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)
+            ) FILTER (WHERE p.id is not null and pfw.role = 'writer'),
+            '[]'
+        ) as writers,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)
+            ) FILTER (WHERE p.id is not null and pfw.role = 'director'),
+            '[]'
+        ) as directors,
+        array_agg(DISTINCT g.name) as genres,
+        COALESCE (array_agg(DISTINCT g.id) FILTER (WHERE g.id is not null), '{}') as genre_ids
+    FROM content.film_work fw
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    GROUP BY fw.id;
+"""
+
+REFRESH_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.refresh_film_work_search(film_ids uuid[]) RETURNS void AS $$
+        DELETE FROM content.film_work_search WHERE id = ANY(film_ids);
+        INSERT INTO content.film_work_search (
+            id, title, description, rating, type, created, permissions, actors, writers, directors, genres, genre_ids
+        )
+        SELECT id, title, description, rating, type, created, permissions, actors, writers, directors, genres, genre_ids
+        FROM content.film_work_document
+        WHERE id = ANY(film_ids);
+    $$ LANGUAGE sql;
+"""
+
+# modified не сдвигается, иначе инкрементальный ETL переиндексировал бы весь каталог одним
+# потоком. genre_ids попадают в индекс movies при пересборке rebuild_index: ETL ставит ее
+# в очередь сам при старте beat, так как схема movies (es-schemas) получила schema_version 2
+BACKFILL = """
+    UPDATE content.film_work_search s
+    SET genre_ids = d.genre_ids
+    FROM content.film_work_document d
+    WHERE d.id = s.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0003_film_work_search"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=FILM_WORK_DOCUMENT_VIEW,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            sql="ALTER TABLE content.film_work_search ADD COLUMN genre_ids uuid[] NOT NULL DEFAULT '{}';",
+            reverse_sql="ALTER TABLE content.film_work_search DROP COLUMN genre_ids;",
+        ),
+        migrations.RunSQL(
+            sql=REFRESH_FUNCTION,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            sql=BACKFILL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
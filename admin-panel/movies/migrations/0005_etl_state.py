@@ -0,0 +1,27 @@
+from django.db import migrations
+
+# Состояние ETL при ETL_STATE_BACKEND=postgres (etl-processes/storage.py, PostgresStorage):
+# строка на каждый ключ состояния задачи
+ETL_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS content.etl_state (
+        state_key TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value JSONB NOT NULL,
+        modified TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+        PRIMARY KEY (state_key, key)
+    );
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0004_film_work_search_genre_ids"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=ETL_STATE_TABLE,
+            reverse_sql="DROP TABLE IF EXISTS content.etl_state;",
+        ),
+    ]
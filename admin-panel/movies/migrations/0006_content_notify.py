@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Канал, который слушает etl-processes/listener.py (ETL_NOTIFY_CHANNEL)
+NOTIFY_CHANNEL = "content_changes"
+
+# Публикует id измененной строки в канал NOTIFY. Для связей фильма с жанрами и персонами
+# публикуются обе стороны связи, а при UPDATE - и старая, и новая, чтобы фильм или персона,
+# от которых связь ушла, тоже переиндексировались
+NOTIFY_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.notify_content_change() RETURNS trigger AS $$
+    DECLARE
+        changed record;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+
+        IF TG_TABLE_NAME = 'genre_film_work' THEN
+            PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'film_work', 'id', changed.film_work_id)::text);
+            PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'genre', 'id', changed.genre_id)::text);
+            IF TG_OP = 'UPDATE' THEN
+                PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'film_work', 'id', OLD.film_work_id)::text);
+                PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'genre', 'id', OLD.genre_id)::text);
+            END IF;
+        ELSIF TG_TABLE_NAME = 'person_film_work' THEN
+            PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'film_work', 'id', changed.film_work_id)::text);
+            PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'person', 'id', changed.person_id)::text);
+            IF TG_OP = 'UPDATE' THEN
+                PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'film_work', 'id', OLD.film_work_id)::text);
+                PERFORM pg_notify(TG_ARGV[0], json_build_object('table', 'person', 'id', OLD.person_id)::text);
+            END IF;
+        ELSE
+            PERFORM pg_notify(TG_ARGV[0], json_build_object('table', TG_TABLE_NAME, 'id', changed.id)::text);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+WATCHED_TABLES = ("film_work", "genre", "person", "genre_film_work", "person_film_work")
+
+TRIGGERS = "".join(f"""
+    CREATE OR REPLACE TRIGGER notify_content_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change('{NOTIFY_CHANNEL}');
+""" for table in WATCHED_TABLES)
+
+DROP_TRIGGERS = "".join(f"DROP TRIGGER IF EXISTS notify_content_change ON content.{table};" for table in WATCHED_TABLES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0005_etl_state"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=NOTIFY_FUNCTION + TRIGGERS,
+            reverse_sql=DROP_TRIGGERS + "DROP FUNCTION IF EXISTS content.notify_content_change();",
+        ),
+    ]
@@ -35,6 +35,9 @@ class Genre(UUIDMixin, TimeStampedMixin):
         verbose_name = _("genre")
         verbose_name_plural = _("genres")
         ordering = ("name",)
+        indexes = [
+            models.Index(fields=["modified", "id"], name="genre_modified_idx"),
+        ]
 
 
 class Person(UUIDMixin, TimeStampedMixin):
@@ -47,6 +50,9 @@ class Person(UUIDMixin, TimeStampedMixin):
         db_table = 'content"."person'
         verbose_name = _("person")
         verbose_name_plural = _("persons")
+        indexes = [
+            models.Index(fields=["modified", "id"], name="person_modified_idx"),
+        ]
 
 
 class FilmTypes(models.TextChoices):
@@ -108,6 +114,7 @@ class FilmWork(UUIDMixin, TimeStampedMixin):
                 fields=["creation_date", "rating"],
                 name="film_work_creation_rating_idx",
             ),
+            models.Index(fields=["modified", "id"], name="film_work_modified_idx"),
         ]
 
 
@@ -127,6 +134,10 @@ class GenreFilmWork(UUIDMixin):
         db_table = 'content"."genre_film_work'
         verbose_name = _("genre")
         verbose_name_plural = _("film genres")
+        indexes = [
+            # Фильмы жанра без обращения к таблице
+            models.Index(fields=["genre"], include=["film_work"], name="genre_film_work_genre_idx"),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=["film_work", "genre"],
@@ -163,6 +174,10 @@ class PersonFilmWork(UUIDMixin):
         db_table = 'content"."person_film_work'
         verbose_name = _("person")
         verbose_name_plural = _("film persons")
+        indexes = [
+            # Фильмы и роли персоны без обращения к таблице
+            models.Index(fields=["person"], include=["film_work", "role"], name="person_film_work_person_idx"),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=["film_work", "person", "role"],
@@ -4,23 +4,21 @@ while ! curl -s "elasticsearch:9200" > /dev/null; do
     sleep 5
 done
 
-if curl -s -f "http://elasticsearch:9200/movies" > /dev/null; then
-    echo "Индекс movies уже существует"
-else
-    echo "Создаем индекс movies"
-    curl -XPUT "http://elasticsearch:9200/movies" -H "Content-Type: application/json" -d @/data/movies.json
-fi
-
-if curl -s -f "http://elasticsearch:9200/genres" > /dev/null; then
-    echo "Индекс genres уже существует"
-else
-    echo "Создаем индекс genres"
-    curl -XPUT "http://elasticsearch:9200/genres" -H "Content-Type: application/json" -d @/data/genres.json
-fi
+# Индексы версионируются (movies_v1, movies_v2, ...), API и ETL работают через алиасы
+for index in movies genres persons; do
+    if curl -s -f "http://elasticsearch:9200/${index}" > /dev/null; then
+        echo "Индекс ${index} уже существует"
+    else
+        echo "Создаем индекс ${index}_v1 с алиасом ${index}"
+        curl -XPUT "http://elasticsearch:9200/${index}_v1" -H "Content-Type: application/json" -d @/data/${index}.json
+        curl -XPOST "http://elasticsearch:9200/_aliases" -H "Content-Type: application/json" \
+            -d "{\"actions\": [{\"add\": {\"index\": \"${index}_v1\", \"alias\": \"${index}\", \"is_write_index\": true}}]}"
+    fi
+    # Служебное поле с хешами содержимого для частичных обновлений ETL (для индексов, созданных до него)
+    curl -s -XPUT "http://elasticsearch:9200/${index}/_mapping" -H "Content-Type: application/json" \
+        -d '{"properties": {"etl_hashes": {"type": "object", "enabled": false}}}' > /dev/null
+done
 
-if curl -s -f "http://elasticsearch:9200/persons" > /dev/null; then
-    echo "Индекс persons уже существует"
-else
-    echo "Создаем индекс persons"
-    curl -XPUT "http://elasticsearch:9200/persons" -H "Content-Type: application/json" -d @/data/persons.json
-fi
\ No newline at end of file
+# id жанров фильма для фильтрации без поиска жанра по имени (для индекса, созданного до этого поля)
+curl -s -XPUT "http://elasticsearch:9200/movies/_mapping" -H "Content-Type: application/json" \
+    -d '{"properties": {"genre_ids": {"type": "keyword"}}}' > /dev/null
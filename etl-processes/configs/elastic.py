@@ -12,6 +12,10 @@ class ElasticSettings(BaseSettings):
     NODES: list[str] = ["http://elasticsearch:9200"]
     USERNAME: str = ""
     PASSWORD: str = ""
+    # Каталог со схемами индексов (es-schemas)
+    SCHEMAS_DIR: str = "es-schemas"
+    # Сколько предыдущих версий индекса хранить для отката
+    KEEP_VERSIONS: int = 1
 
     @field_validator("NODES", mode="before")
     @classmethod
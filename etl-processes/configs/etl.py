@@ -0,0 +1,68 @@
+from typing import Literal
+
+from pydantic_settings import SettingsConfigDict
+
+from .base import BaseSettings
+
+
+class EtlSettings(BaseSettings):
+    """
+    Конфиг процессов ETL
+    """
+
+    model_config = SettingsConfigDict(env_prefix="ETL_")
+
+    # Размер пачки документов, отправляемой в Elasticsearch
+    BATCH_SIZE: int = 1000
+    # Сколько строк читает один запрос keyset-пагинации (одна короткая транзакция)
+    PAGE_SIZE: int = 5000
+    # Потоковое чтение через серверный (именованный) курсор выборок фильмов по спискам изменившихся
+    # персон и жанров: они не ограничены PAGE_SIZE. Страницы keyset-пагинации ограничены и всегда
+    # читаются клиентским курсором подготовленными запросами
+    STREAMING: bool = True
+    # Сколько строк серверный курсор забирает из Postgres за один сетевой вызов
+    ITERSIZE: int = 2000
+    # strict - валидация каждой строки pydantic-моделью,
+    # trusted - сериализация строк сразу в тело bulk-запроса без промежуточных моделей
+    TRANSFORM_MODE: Literal["strict", "trusted"] = "trusted"
+    # Сколько пачек может ждать своей очереди между этапами конвейера
+    PIPELINE_QUEUE_SIZE: int = 4
+    # Количество потоков, параллельно отправляющих bulk-запросы
+    BULK_THREADS: int = 4
+    # Максимальный размер одного bulk-запроса в байтах
+    BULK_CHUNK_BYTES: int = 1024 * 1024
+    # Повторы bulk-запроса при перегрузке кластера (429) в однопоточном режиме
+    BULK_MAX_RETRIES: int = 3
+    # Частичные обновления: только поля своей группы и пропуск неизменившихся документов по хешу
+    PARTIAL_UPDATES: bool = True
+    # На сколько диапазонов id (параллельных задач) делится сборка новой версии индекса
+    REINDEX_SHARDS: int = 4
+    # Где хранится состояние (курсоры) задач и их локи: redis или таблица и advisory-локи в Postgres
+    STATE_BACKEND: Literal["redis", "postgres"] = "redis"
+    # Откуда читаются фильмы: tables - агрегация по таблицам content, search - готовые документы
+    # из content.film_work_search (миграция movies 0003), которые триггеры пересобирают при изменении
+    # персон и жанров, поэтому отдельные проходы по фильмам измененных персон и жанров не нужны
+    MOVIES_SOURCE: Literal["tables", "search"] = "tables"
+    # Канал redis кеша API, в который публикуются id измененных документов
+    INVALIDATION_CHANNEL: str = "content_invalidation"
+    # Порт HTTP-сервера метрик Prometheus на воркере celery
+    METRICS_PORT: int = 9100
+    # Одна задача sync_content для всех индексов вместо трех отдельных update_*_index
+    UNIFIED_SYNC: bool = True
+    # Минимальный период опроса Postgres периодическими задачами (страховка для ленты изменений)
+    POLL_INTERVAL: float = 5.0
+    # Максимальная пауза между запусками, до которой растет опрос при отсутствии изменений
+    POLL_MAX_INTERVAL: float = 5 * 60.0
+    # Сколько секунд периодическая задача выбирает изменения за запуск. Если изменения
+    # не дочитаны за это время, следующий запуск идет сразу, не дожидаясь расписания
+    RUN_TIME_LIMIT: float = 60.0
+    # Канал LISTEN/NOTIFY, в который триггеры схемы content пишут измененные id. Триггеры создает
+    # миграция movies 0006_content_notify, и канал должен совпадать с указанным в ней
+    NOTIFY_CHANNEL: str = "content_changes"
+    # Сколько секунд после первого уведомления копить остальные в одну задачу
+    NOTIFY_DEBOUNCE: float = 0.2
+    # Максимум уведомлений в одной задаче синхронизации
+    NOTIFY_MAX_BATCH: int = 1000
+
+
+ETL = EtlSettings()
@@ -16,5 +16,15 @@ class PostgresSettings(BaseSettings):
     PASSWORD: str = "123qwe"
     DB: str = "movies_database"
 
+    # Пул подключений процесса-воркера
+    POOL_MIN_SIZE: int = 1
+    POOL_MAX_SIZE: int = 4
+    # Через сколько секунд простоя лишние (сверх минимума) подключения закрываются
+    POOL_MAX_IDLE: float = 5 * 60.0
+    # Через сколько секунд подключение пересоздается, даже если оно исправно
+    POOL_MAX_LIFETIME: float = 60 * 60.0
+    # Сколько секунд задача ждет свободное подключение
+    POOL_TIMEOUT: float = 30.0
+
 
 POSTGRES = PostgresSettings()
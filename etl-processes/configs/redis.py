@@ -24,3 +24,17 @@ class RedisSettings(BaseSettings):
 
 
 REDIS = RedisSettings()
+
+
+class CacheRedisSettings(RedisSettings):
+    """
+    Конфиг подключения к редису кеша API, в который публикуются изменения индексов
+    """
+
+    model_config = SettingsConfigDict(env_prefix="REDIS_CACHE_")
+
+    HOST: str = "redis-movie"
+    DB: str = "0"
+
+
+REDIS_CACHE = CacheRedisSettings()
@@ -1,25 +1,104 @@
 import logging
 from contextlib import contextmanager
-from typing import Generator
+from functools import partial
+from typing import Any, Generator
 
 import psycopg
 import redis
 from configs.elastic import ELASTIC
+from configs.etl import ETL
 from configs.postgres import POSTGRES
-from configs.redis import REDIS
+from configs.redis import REDIS, REDIS_CACHE
 from elasticsearch import Elasticsearch
+from psycopg_pool import ConnectionPool
+
+# Пул подключений процесса-воркера: открывается и закрывается сигналами celery (см. scheduler.py)
+postgres_pool: ConnectionPool | None = None
+# Отдельный пул сессий для advisory-локов (ETL.STATE_BACKEND = postgres): лок держится всю задачу,
+# поэтому его подключения не должны занимать пул извлечения
+postgres_lock_pool: ConnectionPool | None = None
+
+
+def _postgres_params() -> dict[str, Any]:
+    return {
+        "dbname": POSTGRES.DB,
+        "host": POSTGRES.HOST,
+        "user": POSTGRES.USERNAME,
+        "password": POSTGRES.PASSWORD,
+        "port": POSTGRES.PORT,
+    }
+
+
+def postgres_connection(**kwargs) -> psycopg.Connection:
+    """Новое подключение к Postgres в обход пула (для LISTEN и сессионных локов)"""
+    return psycopg.connect(**_postgres_params(), **kwargs)
+
+
+def _pool(name: str, connection_kwargs: dict[str, Any] | None = None, **kwargs) -> ConnectionPool:
+    return ConnectionPool(
+        kwargs={**_postgres_params(), **(connection_kwargs or {})},
+        min_size=POSTGRES.POOL_MIN_SIZE,
+        max_size=POSTGRES.POOL_MAX_SIZE,
+        max_idle=POSTGRES.POOL_MAX_IDLE,
+        max_lifetime=POSTGRES.POOL_MAX_LIFETIME,
+        timeout=POSTGRES.POOL_TIMEOUT,
+        # Подключение проверяется перед выдачей, поэтому оборванное сервером не попадет в задачу
+        check=ConnectionPool.check_connection,
+        name=name,
+        open=True,
+        **kwargs,
+    )
+
+
+def _unlock_all(connection: psycopg.Connection) -> None:
+    # Сессия возвращается в пул без локов, даже если задача не смогла отпустить свой
+    connection.execute("SELECT pg_advisory_unlock_all();")
+
+
+def open_postgres_pool() -> None:
+    """Открывает пулы подключений текущего процесса"""
+    global postgres_pool, postgres_lock_pool
+    postgres_pool = _pool("etl")
+    if ETL.STATE_BACKEND == "postgres":
+        postgres_lock_pool = _pool("etl_locks", connection_kwargs={"autocommit": True}, reset=_unlock_all)
+
+
+def close_postgres_pool() -> None:
+    """Закрывает пулы подключений текущего процесса"""
+    global postgres_pool, postgres_lock_pool
+    for pool in (postgres_pool, postgres_lock_pool):
+        if pool is not None:
+            pool.close()
+    postgres_pool = postgres_lock_pool = None
+
+
+def lock_connection() -> psycopg.Connection:
+    """Подключение в autocommit для сессионного advisory-лока: из пула локов, если он открыт"""
+    if postgres_lock_pool is None:
+        return postgres_connection(autocommit=True)
+    return postgres_lock_pool.getconn()
+
+
+def release_lock_connection(connection: psycopg.Connection) -> None:
+    """Возвращает подключение, полученное через lock_connection"""
+    if postgres_lock_pool is None:
+        connection.close()
+    else:
+        postgres_lock_pool.putconn(connection)
 
 
 @contextmanager
 def postgres_connector() -> Generator[psycopg.Connection, None, None]:
-    """Контекстный менеджер для работы с Postgres"""
-    connection: psycopg.Connection = psycopg.connect(
-        dbname=POSTGRES.DB,
-        host=POSTGRES.HOST,
-        user=POSTGRES.USERNAME,
-        password=POSTGRES.PASSWORD,
-        port=POSTGRES.PORT,
-    )
+    """Контекстный менеджер для работы с Postgres.
+
+    Подключение берется из пула процесса, если он открыт, иначе открывается новое.
+    """
+    if postgres_pool is None:
+        connection: psycopg.Connection = postgres_connection()
+        release = connection.close
+    else:
+        connection = postgres_pool.getconn()
+        release = partial(postgres_pool.putconn, connection)
 
     try:
         yield connection
@@ -27,7 +106,21 @@ def postgres_connector() -> Generator[psycopg.Connection, None, None]:
         connection.rollback()
         logging.exception(e)
     finally:
-        connection.close()
+        release()
+
+
+def postgres_cursor(connection: psycopg.Connection, name: str) -> psycopg.Cursor | psycopg.ServerCursor:
+    """Курсор для извлечения данных.
+
+    В потоковом режиме возвращает серверный (именованный) курсор, который читает
+    результат порциями по ETL.ITERSIZE строк вместо буферизации всей выборки.
+    """
+    if not ETL.STREAMING:
+        return connection.cursor()
+
+    cursor = connection.cursor(name=name)
+    cursor.itersize = ETL.ITERSIZE
+    return cursor
 
 
 redis_client = redis.Redis.from_url(
@@ -37,6 +130,8 @@ redis_client = redis.Redis.from_url(
     max_connections=1000,
 )
 
+cache_redis_client = redis.Redis.from_url(REDIS_CACHE.URI)
+
 elastic_client = Elasticsearch(
     hosts=ELASTIC.NODES,
     request_timeout=60,
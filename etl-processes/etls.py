@@ -1,259 +1,884 @@
-import sqlite3
-from datetime import datetime
-from typing import Generator, TypeVar
+import hashlib
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, NamedTuple, TypeVar
+from uuid import UUID
 
+import orjson
 import psycopg
 from configs.elastic import ELASTIC
+from configs.etl import ETL
 from elasticsearch import Elasticsearch, helpers
+from invalidation import CacheInvalidator
+from metrics import BULK_ERRORS
+from pydantic import BaseModel
 from schemas import GenresElasticsearchModel, MoviesElasticsearchModel, PersonsElasticsearchModel
+from storage import INITIAL_CHECKPOINT, BaseStorage, Checkpoint
 
 T = TypeVar("T")
 
-BATCH_SIZE = 100
+BATCH_SIZE = ETL.BATCH_SIZE
+
+# Настройки индекса на время полной переиндексации
+BULK_INDEXING_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": 0}
+
+
+# Пропускает обновление, если хеши всех присланных групп полей совпадают с сохраненными в документе
+PARTIAL_UPDATE_SCRIPT = """
+    Map stored = ctx._source.etl_hashes;
+    if (stored != null) {
+        boolean same = true;
+        for (entry in params.hashes.entrySet()) {
+            if (!entry.getValue().equals(stored.get(entry.getKey()))) {
+                same = false;
+                break;
+            }
+        }
+        if (same) {
+            ctx.op = 'noop';
+            return;
+        }
+    }
+    ctx._source.putAll(params.doc);
+    if (stored == null) {
+        ctx._source.etl_hashes = params.hashes;
+    } else {
+        stored.putAll(params.hashes);
+    }
+"""
+
+
+class RawDocument(NamedTuple):
+    """Документ, сериализованный быстрым путем трансформации, без pydantic-модели."""
+
+    id: UUID
+    # Тело update-действия bulk-запроса (см. UpdateBuilder)
+    body: bytes
+
+
+class UpdateBuilder:
+    """Тело update-действия bulk-запроса для документа индекса.
+
+    Поля документа разбиты на группы, каждой группой владеет свой проход извлечения:
+    например, в movies жанры пишет только проход по изменившимся жанрам, а персон - проход
+    по изменившимся персонам. В документ попадают только поля, которые пришли из выборки,
+    а для каждой присланной группы считается хеш содержимого. Хеши хранятся в документе
+    (поле etl_hashes), и если они совпали, Elasticsearch не переписывает документ (noop).
+
+    Без partial - прежнее поведение: {"doc": {...}, "doc_as_upsert": true}.
+    """
+
+    def __init__(self, groups: dict[str, tuple[str, ...]], partial: bool = ETL.PARTIAL_UPDATES):
+        self.groups = groups
+        self.partial = partial
+
+    def body(self, doc: dict[str, Any]) -> bytes:
+        if not self.partial:
+            return orjson.dumps({"doc": doc, "doc_as_upsert": True})
+
+        hashes = {}
+        for group, fields in self.groups.items():
+            content = {field: doc[field] for field in fields if field in doc}
+            if content:
+                hashes[group] = hashlib.blake2b(
+                    orjson.dumps(content, option=orjson.OPT_SORT_KEYS), digest_size=16
+                ).hexdigest()
+
+        return orjson.dumps(
+            {
+                "script": {
+                    "source": PARTIAL_UPDATE_SCRIPT,
+                    "lang": "painless",
+                    "params": {"doc": doc, "hashes": hashes},
+                },
+                "upsert": {**doc, "etl_hashes": hashes},
+            }
+        )
+
+
+MOVIES_UPDATES = UpdateBuilder(
+    groups={
+        "film": ("title", "description", "imdb_rating", "permissions"),
+        "genres": ("genres", "genre_ids"),
+        "persons": ("actors", "directors", "writers", "actors_names", "directors_names", "writers_names"),
+    }
+)
+GENRES_UPDATES = UpdateBuilder(groups={"genre": ("name",)})
+PERSONS_UPDATES = UpdateBuilder(groups={"person": ("full_name", "films")})
+
+
+class BulkResult(NamedTuple):
+    """Итог загрузки пачки: сколько документов записано и ошибки по отдельным документам."""
+
+    success: int
+    errors: list[dict[str, Any]]
+    # id документов, которые действительно изменились (без noop)
+    changed: list[str] = []
+
+
+def _prepared_action(action: tuple[bytes, bytes]) -> tuple[bytes, bytes]:
+    """Действие уже сериализовано в пару (заголовок, тело) - отдаем bulk-хелперу как есть"""
+    return action
 
 
 class ElasticsearchUploader:
-    def __init__(self, elastic_client: Elasticsearch):
+    """Загрузка документов в Elasticsearch.
+
+    Пачка режется на чанки по размеру в байтах (ETL.BULK_CHUNK_BYTES) и отправляется
+    в ETL.BULK_THREADS потоков. Ошибка отдельного документа не роняет всю пачку:
+    такие документы логируются и возвращаются в BulkResult.errors.
+
+    Если передан invalidator, id измененных документов публикуются после каждой пачки,
+    чтобы API сбросил их из кеша.
+    """
+
+    def __init__(
+        self,
+        elastic_client: Elasticsearch,
+        thread_count: int = ETL.BULK_THREADS,
+        max_chunk_bytes: int = ETL.BULK_CHUNK_BYTES,
+        invalidator: CacheInvalidator | None = None,
+    ):
         self.elastic_client = elastic_client
+        self.thread_count = thread_count
+        self.max_chunk_bytes = max_chunk_bytes
+        self.invalidator = invalidator
+
+    def bulk_update_movies(self, data: list[MoviesElasticsearchModel], index: str = ELASTIC.MOVIES_INDEX) -> BulkResult:
+        return self._bulk_update(index, data, MOVIES_UPDATES)
+
+    def bulk_update_genres(self, data: list[GenresElasticsearchModel], index: str = ELASTIC.GENRES_INDEX) -> BulkResult:
+        return self._bulk_update(index, data, GENRES_UPDATES)
+
+    def bulk_update_persons(
+        self, data: list[PersonsElasticsearchModel], index: str = ELASTIC.PERSONS_INDEX
+    ) -> BulkResult:
+        return self._bulk_update(index, data, PERSONS_UPDATES)
 
-    def bulk_update_movies(self, data: list[MoviesElasticsearchModel]):
-        helpers.bulk(
-            client=self.elastic_client,
-            actions=[
-                {
-                    "_index": ELASTIC.MOVIES_INDEX,
-                    "_op_type": "update",
-                    "_id": item.id,
-                    "_retry_on_conflict": 1,
-                    "doc_as_upsert": True,
-                    "doc": item.model_dump(exclude_none=True, by_alias=True, exclude={"updated_at"}),
-                }
-                for item in data
-            ],
+    def _bulk_update(self, index: str, data: list[BaseModel | RawDocument], updates: UpdateBuilder) -> BulkResult:
+        # Действия собираются сразу в байты, чтобы bulk-хелпер не сериализовал их повторно
+        actions = (
+            (
+                orjson.dumps({"update": {"_index": index, "_id": item.id, "retry_on_conflict": 1}}),
+                self._body(item, updates),
+            )
+            for item in data
         )
+        # Лимит по количеству документов заведомо больше пачки - чанки режутся по байтам
+        options = {
+            "chunk_size": max(len(data), 1),
+            "max_chunk_bytes": self.max_chunk_bytes,
+            "raise_on_error": False,
+            "expand_action_callback": _prepared_action,
+        }
+
+        if self.thread_count > 1:
+            responses = helpers.parallel_bulk(self.elastic_client, actions, thread_count=self.thread_count, **options)
+        else:
+            responses = helpers.streaming_bulk(
+                self.elastic_client, actions, max_retries=ETL.BULK_MAX_RETRIES, **options
+            )
 
-    def bulk_update_genres(self, data: list[GenresElasticsearchModel]):
-        helpers.bulk(
-            client=self.elastic_client,
-            actions=[
-                {
-                    "_index": ELASTIC.GENRES_INDEX,
-                    "_op_type": "update",
-                    "_id": item.id,
-                    "_retry_on_conflict": 1,
-                    "doc_as_upsert": True,
-                    "doc": item.model_dump(exclude_none=True, by_alias=True, exclude={"updated_at"}),
-                }
-                for item in data
-            ],
+        success, errors, changed = 0, [], []
+        for ok, item in responses:
+            if ok:
+                success += 1
+                if item["update"].get("result") != "noop":
+                    changed.append(item["update"]["_id"])
+            else:
+                errors.append(item)
+
+        if errors:
+            BULK_ERRORS.labels(index=index).inc(len(errors))
+            logging.error(f"🚨 {len(errors)} documents failed to index into {index}: {errors[:5]}")
+        if changed and self.invalidator:
+            self.invalidator.publish(index, changed)
+        return BulkResult(success=success, errors=errors, changed=changed)
+
+    @staticmethod
+    def _body(item: BaseModel | RawDocument, updates: UpdateBuilder) -> bytes:
+        if isinstance(item, RawDocument):
+            return item.body
+        return updates.body(item.model_dump(exclude_none=True, by_alias=True, exclude={"updated_at"}))
+
+    @contextmanager
+    def bulk_indexing(self, index: str, backup: BaseStorage) -> Generator[None, None, None]:
+        """Режим полной переиндексации: отключает refresh и реплики на время загрузки.
+
+        Исходные настройки сохраняются в backup до изменения индекса, поэтому даже если
+        воркер упадет посреди загрузки, следующий запуск задачи вернет их через
+        restore_index_settings.
+        """
+        self.enable_bulk_indexing(index, backup)
+        try:
+            yield
+        finally:
+            self.restore_index_settings(index, backup)
+
+    def enable_bulk_indexing(self, index: str, backup: BaseStorage) -> None:
+        """Отключает refresh и реплики, сохранив исходные настройки в backup (см. bulk_indexing).
+
+        Если в backup уже есть настройки, режим включен прерванной загрузкой, и она просто
+        продолжается: настройки возвращаются и сегменты сливаются один раз, в конце загрузки.
+        """
+        if backup.retrieve_state():
+            return
+
+        response = self.elastic_client.indices.get_settings(
+            index=index, name=list(BULK_INDEXING_SETTINGS), flat_settings=True, include_defaults=True
         )
+        current = next(iter(response.values()))
+        original = {
+            name: current.get("settings", {}).get(name, current.get("defaults", {}).get(name))
+            for name in BULK_INDEXING_SETTINGS
+        }
+        backup.save_state({"settings": original})
+        self.elastic_client.indices.put_settings(index=index, settings=BULK_INDEXING_SETTINGS)
+        logging.info(f"Bulk indexing mode enabled for {index}, original settings: {original}")
+
+    def restore_index_settings(self, index: str, backup: BaseStorage) -> None:
+        """Возвращает настройки индекса, сохраненные перед полной переиндексацией, и сливает сегменты"""
+        saved = backup.retrieve_state()
+        if not saved:
+            return
+
+        self.elastic_client.indices.put_settings(index=index, settings=saved["settings"])
+        self.elastic_client.indices.refresh(index=index)
+        # Слияние сегментов может идти долго - не ждем его завершения
+        self.elastic_client.indices.forcemerge(index=index, max_num_segments=1, wait_for_completion=False)
+        backup.save_state({})
+        logging.info(f"Index settings restored for {index}: {saved['settings']}")
+
+
+def keyset_query(template: str, alias: str, table: str, sharded: bool = False, exists: str | None = None) -> str:
+    """Страница keyset-пагинации по (modified, id) таблицы alias, при sharded - в пределах диапазона id.
+
+    Сначала по индексу (modified, id) таблицы table выбираются id страницы (CTE page), и шаблон
+    соединяет и агрегирует только их: страница стоит O(PAGE_SIZE), а не O(остатка таблицы).
+    exists - условие, которому должна удовлетворять строка страницы, если шаблон отбрасывает
+    остальные (например, внутренним соединением), иначе страница окажется неполной.
+    """
+    condition = f"({alias}.modified, {alias}.id) > (%(modified)s, %(id)s)"
+    if sharded:
+        condition += f" AND {alias}.id BETWEEN %(lower)s AND %(upper)s"
+    if exists:
+        condition += f" AND {exists}"
+    page = f"""
+    WITH page AS (
+        SELECT {alias}.id
+        FROM {table} {alias}
+        WHERE {condition}
+        ORDER BY {alias}.modified, {alias}.id
+        LIMIT %(limit)s
+    )"""
+    return (
+        page
+        + template.format(condition=f"{alias}.id IN (SELECT id FROM page)")
+        + f"ORDER BY {alias}.modified, {alias}.id;"
+    )
+
+
+def ids_query(template: str, alias: str) -> str:
+    """Выборка по явному списку id таблицы alias"""
+    return template.format(condition=f"{alias}.id = ANY(%(ids)s::uuid[])") + ";"
+
+
+MOVIES_TEMPLATE = """
+    SELECT
+    fw.id,
+    fw.title,
+    fw.description,
+    fw.rating,
+    fw.type,
+    fw.created,
+    fw.modified,
+    fw.permissions,
+    COALESCE (
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'id', p.id,
+                'name', p.full_name
+            )
+        ) FILTER (WHERE p.id is not null and pfw.role = 'actor'),
+        '[]'
+    ) as actors,
+        COALESCE (
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'id', p.id,
+                'name', p.full_name
+            )
+        ) FILTER (WHERE p.id is not null and pfw.role = 'writer'),
+        '[]'
+    ) as writers,
+        COALESCE (
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'id', p.id,
+                'name', p.full_name
+            )
+        ) FILTER (WHERE p.id is not null and pfw.role = 'director'),
+        '[]'
+    ) as directors,
+    array_agg(DISTINCT g.name) as genres,
+    COALESCE (array_agg(DISTINCT g.id) FILTER (WHERE g.id is not null), ARRAY[]::uuid[]) as genre_ids
+    FROM content.film_work fw
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE {condition}
+    GROUP BY fw.id
+"""
+
+GENRES_TEMPLATE = """
+    SELECT
+        g.id,
+        g.name,
+        g.modified
+    FROM content.genre g
+    JOIN content.genre_film_work gfw ON g.id = gfw.genre_id
+    WHERE {condition}
+    GROUP BY g.id
+"""
+
+# Фильмы с ролями собираются отдельно для каждой персоны, а не группировкой всей person_film_work
+PERSONS_TEMPLATE = """
+    SELECT
+        p.id,
+        p.full_name,
+        p.modified,
+        JSON_AGG(
+            JSONB_BUILD_OBJECT(
+                'id', pfw.film_work_id,
+                'roles', roles_array
+            )
+        ) AS films
+    FROM content.person p
+    JOIN LATERAL (
+        SELECT
+            pfw.film_work_id,
+            ARRAY_AGG(pfw.role) AS roles_array
+        FROM content.person_film_work pfw
+        WHERE pfw.person_id = p.id
+        GROUP BY pfw.film_work_id
+    ) pfw ON true
+    WHERE {condition}
+    GROUP BY p.id
+"""
+
+# Те же документы, собранные заранее в content.film_work_search
+FILM_WORK_SEARCH_TEMPLATE = """
+    SELECT
+        s.id,
+        s.title,
+        s.description,
+        s.rating,
+        s.type,
+        s.created,
+        s.modified,
+        s.permissions,
+        s.actors,
+        s.writers,
+        s.directors,
+        s.genres,
+        s.genre_ids
+    FROM content.film_work_search s
+    WHERE {condition}
+"""
+
+# Запросы фильмов строятся для обоих источников, чтобы ошибка в любом шаблоне падала
+# при импорте модуля (и при сборке образа), а не только после переключения ETL_MOVIES_SOURCE
+MOVIES_SOURCE_QUERIES = {
+    "tables": (
+        keyset_query(MOVIES_TEMPLATE, "fw", "content.film_work"),
+        keyset_query(MOVIES_TEMPLATE, "fw", "content.film_work", sharded=True),
+        ids_query(MOVIES_TEMPLATE, "fw"),
+    ),
+    "search": (
+        keyset_query(FILM_WORK_SEARCH_TEMPLATE, "s", "content.film_work_search"),
+        keyset_query(FILM_WORK_SEARCH_TEMPLATE, "s", "content.film_work_search", sharded=True),
+        ids_query(FILM_WORK_SEARCH_TEMPLATE, "s"),
+    ),
+}
+MOVIES_QUERY, MOVIES_SHARD_QUERY, MOVIES_BY_IDS_QUERY = MOVIES_SOURCE_QUERIES[ETL.MOVIES_SOURCE]
+# В индексы genres и persons попадают только жанры и персоны, у которых есть фильмы
+GENRES_WITH_FILMS = "EXISTS (SELECT 1 FROM content.genre_film_work gfw WHERE gfw.genre_id = g.id)"
+PERSONS_WITH_FILMS = "EXISTS (SELECT 1 FROM content.person_film_work pfw WHERE pfw.person_id = p.id)"
+GENRES_QUERY = keyset_query(GENRES_TEMPLATE, "g", "content.genre", exists=GENRES_WITH_FILMS)
+GENRES_SHARD_QUERY = keyset_query(GENRES_TEMPLATE, "g", "content.genre", sharded=True, exists=GENRES_WITH_FILMS)
+GENRES_BY_IDS_QUERY = ids_query(GENRES_TEMPLATE, "g")
+PERSONS_QUERY = keyset_query(PERSONS_TEMPLATE, "p", "content.person", exists=PERSONS_WITH_FILMS)
+PERSONS_SHARD_QUERY = keyset_query(PERSONS_TEMPLATE, "p", "content.person", sharded=True, exists=PERSONS_WITH_FILMS)
+PERSONS_BY_IDS_QUERY = ids_query(PERSONS_TEMPLATE, "p")
+
+# Изменившиеся жанры и персоны: (modified, id) после курсора
+CHANGED_GENRES_QUERY = """
+    SELECT g.modified, g.id
+    FROM content.genre g
+    WHERE (g.modified, g.id) > (%(modified)s, %(id)s)
+    ORDER BY g.modified, g.id
+    LIMIT %(limit)s;
+"""
+
+CHANGED_PERSONS_QUERY = """
+    SELECT p.modified, p.id
+    FROM content.person p
+    WHERE (p.modified, p.id) > (%(modified)s, %(id)s)
+    ORDER BY p.modified, p.id
+    LIMIT %(limit)s;
+"""
+
+# Жанры и персоны фильмов, в которых участвуют жанры или персоны из списка %(ids)s
+FILM_GENRES_QUERY = """
+    SELECT
+        fw.id,
+        fw.modified,
+        array_agg(DISTINCT g.name) as genres,
+        array_agg(DISTINCT g.id) as genre_ids
+    FROM content.film_work fw
+    JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE fw.id IN (
+        SELECT film_work_id FROM content.genre_film_work WHERE genre_id = ANY(%(ids)s::uuid[])
+    )
+    GROUP BY fw.id;
+"""
+
+FILM_PERSONS_QUERY = """
+    SELECT
+        fw.id,
+        fw.modified,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'id', p.id,
+                    'name', p.full_name
+                )
+            ) FILTER (WHERE pfw.role = 'actor'),
+            '[]'
+        ) AS actors,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'id', p.id,
+                    'name', p.full_name
+                )
+            ) FILTER (WHERE pfw.role = 'writer'),
+            '[]'
+        ) AS writers,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'id', p.id,
+                    'name', p.full_name
+                )
+            ) FILTER (WHERE pfw.role = 'director'),
+            '[]'
+        ) AS directors
+    FROM content.film_work fw
+    JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    JOIN content.person p ON p.id = pfw.person_id
+    WHERE fw.id IN (
+        SELECT film_work_id FROM content.person_film_work WHERE person_id = ANY(%(ids)s::uuid[])
+    )
+    GROUP BY fw.id;
+"""
+
 
-    def bulk_update_persons(self, data: list[PersonsElasticsearchModel]):
-        helpers.bulk(
-            client=self.elastic_client,
-            actions=[
-                {
-                    "_index": ELASTIC.PERSONS_INDEX,
-                    "_op_type": "update",
-                    "_id": item.id,
-                    "_retry_on_conflict": 1,
-                    "doc_as_upsert": True,
-                    "doc": item.model_dump(exclude_none=True, by_alias=True, exclude={"updated_at"}),
-                }
-                for item in data
-            ],
+class Shard(NamedTuple):
+    """Диапазон id (включительно), который переиндексируется отдельной задачей."""
+
+    lower: UUID
+    upper: UUID
+
+
+def id_shards(count: int) -> list[Shard]:
+    """Делит пространство UUID на count равных диапазонов.
+
+    id в базе - случайные UUID4, поэтому строки распределяются по диапазонам равномерно.
+    """
+    step = 2**128 // count
+    return [
+        Shard(
+            lower=UUID(int=number * step), upper=UUID(int=(number + 1) * step - 1 if number < count - 1 else 2**128 - 1)
         )
+        for number in range(count)
+    ]
+
+
+class ExtractedBatch(NamedTuple):
+    """Пачка строк и курсор, до которого можно сдвинуть состояние после ее загрузки."""
+
+    rows: list[tuple]
+    columns: tuple[str, ...]
+    # None - пачка прочитана по списку id и не сдвигает состояние
+    checkpoint: Checkpoint | None
+    # Индекс, в который идет пачка, если один проход наполняет несколько индексов
+    index: str | None = None
 
 
 class PostgresExtractor:
-    def __init__(self, pg_cursor: psycopg.Cursor):
+    """Извлечение данных из Postgres с keyset-пагинацией по (modified, id).
+
+    Каждая страница читается отдельным коротким запросом в своей транзакции,
+    поэтому после сбоя загрузка продолжается ровно с последней сохраненной строки,
+    а строки с одинаковым modified не теряются и не дублируются.
+    """
+
+    def __init__(self, pg_cursor: psycopg.Cursor | psycopg.ServerCursor):
         self.pg_cursor = pg_cursor
+        # Запросы с ограниченным результатом (страницы keyset-пагинации, списки изменившихся id,
+        # счетчики) всегда идут через клиентский курсор, чтобы выполняться подготовленными
+        # операторами. pg_cursor (серверный при ETL.STREAMING) читает выборки фильмов по спискам
+        # сущностей, размер которых ничем не ограничен
+        if isinstance(pg_cursor, psycopg.ServerCursor):
+            self.lookup_cursor = pg_cursor.connection.cursor()
+        else:
+            self.lookup_cursor = pg_cursor
+
+    @staticmethod
+    def _execute(cursor: psycopg.Cursor | psycopg.ServerCursor, query: str, params: dict[str, Any] | None = None):
+        """Выполняет запрос с параметрами, переданными отдельно от текста запроса.
 
-    def extract_movies_data(self, from_ts: datetime = None) -> Generator[list[sqlite3.Row], None, None]:
-        """Метод для извлечения данных о фильмах из БД"""
-        where_clause = f"WHERE fw.modified > '{from_ts}'" if from_ts else ""
-
-        query = f"""
-            SELECT
-            fw.id,
-            fw.title,
-            fw.description,
-            fw.rating,
-            fw.type,
-            fw.created,
-            fw.modified,
-            fw.permissions,
-            COALESCE (
-                json_agg(
-                    DISTINCT jsonb_build_object(
-                        'id', p.id,
-                        'name', p.full_name
-                    )
-                ) FILTER (WHERE p.id is not null and pfw.role = 'actor'),
-                '[]'
-            ) as actors,
-                COALESCE (
-                json_agg(
-                    DISTINCT jsonb_build_object(
-                        'id', p.id,
-                        'name', p.full_name
-                    )
-                ) FILTER (WHERE p.id is not null and pfw.role = 'writer'),
-                '[]'
-            ) as writers,
-                COALESCE (
-                json_agg(
-                    DISTINCT jsonb_build_object(
-                        'id', p.id,
-                        'name', p.full_name
-                    )
-                ) FILTER (WHERE p.id is not null and pfw.role = 'director'),
-                '[]'
-            ) as directors,
-            array_agg(DISTINCT g.name) as genres
-            FROM content.film_work fw
-            LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-            LEFT JOIN content.person p ON p.id = pfw.person_id
-            LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-            LEFT JOIN content.genre g ON g.id = gfw.genre_id
-            {where_clause}
-            GROUP BY fw.id
-            ORDER BY fw.modified;
+        На клиентском курсоре запрос выполняется подготовленным оператором: Postgres
+        разбирает и планирует его один раз на подключение (а подключения живут в пуле),
+        дальше передаются только параметры. Серверный курсор (ETL.STREAMING) объявляется
+        через DECLARE, который подготовить нельзя.
         """
-        self.pg_cursor.execute(query)
-        while results := self.pg_cursor.fetchmany(BATCH_SIZE):
-            yield results
-
-    def extract_genres_from_films_data(self, from_ts: datetime = None) -> Generator[list[sqlite3.Row], None, None]:
-        """Метод для извлечения данных о жанрах из БД"""
-        where_clause = f"WHERE g.modified > '{from_ts}'" if from_ts else ""
-
-        query = f"""
-            SELECT
-                fw.id,
-                max(g.modified) modified,
-                array_agg(DISTINCT g.name) as genres
-            FROM content.genre g
-            LEFT JOIN content.genre_film_work gfw ON gfw.genre_id = g.id
-            LEFT JOIN content.film_work fw ON fw.id = gfw.film_work_id
-            {where_clause}
-            GROUP BY fw.id
-            ORDER BY max(g.modified);
+        if isinstance(cursor, psycopg.ServerCursor):
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query, params, prepare=True)
+
+    def _fetch_batches(
+        self, query: str, params: dict[str, Any], cursor: psycopg.Cursor | psycopg.ServerCursor | None = None
+    ) -> Generator[list[tuple], None, None]:
+        """Выполняет запрос на cursor (по умолчанию pg_cursor) и отдает результат пачками по BATCH_SIZE строк.
+
+        Для серверного курсора строки подтягиваются из Postgres по мере итерации
+        (по itersize за раз), поэтому память воркера не зависит от размера выборки.
         """
-        self.pg_cursor.execute(query)
-        while results := self.pg_cursor.fetchmany(BATCH_SIZE):
-            yield results
-
-    def extract_genres_data(self, from_ts: datetime = None) -> Generator[list[sqlite3.Row], None, None]:
-        """Метод для извлечения данных о жанрах из БД"""
-        where_clause = f"WHERE g.modified > '{from_ts}'" if from_ts else ""
-
-        query = f"""
-            SELECT
-                g.id,
-                g.name,
-                max(g.modified) modified
-            FROM content.genre g
-            JOIN content.genre_film_work gfw ON g.id = gfw.genre_id
-            {where_clause}
-            GROUP BY g.id
-            ORDER BY max(g.modified);
+        cursor = cursor or self.pg_cursor
+        self._execute(cursor, query, params)
+        batch = []
+        for row in cursor:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _paginate(
+        self, query: str, from_checkpoint: Checkpoint | None, shard: Shard | None = None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Постранично читает запрос, продвигая курсор (modified, id) после каждой пачки.
+
+        Запрос должен фильтровать строки условием (modified, id) > (%(modified)s, %(id)s),
+        сортировать по тем же полям и ограничивать выборку LIMIT %(limit)s. Для shard
+        запрос дополнительно ограничивает id диапазоном %(lower)s - %(upper)s.
         """
-        self.pg_cursor.execute(query)
-        while results := self.pg_cursor.fetchmany(BATCH_SIZE):
-            yield results
-
-    def extract_persons_from_films_data(self, from_ts: datetime = None) -> Generator[list[sqlite3.Row], None, None]:
-        """Метод для извлечения данных о персонах из БД"""
-        where_clause = f"WHERE pfw_sub.film_work_id = fw.id AND p_sub.modified > '{from_ts}'" if from_ts else ""
-        query = f"""
-            SELECT
-                fw.id,
-                MAX(p.modified) modified,
-                COALESCE (
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'id', p.id,
-                            'name', p.full_name
-                        )
-                    ) FILTER (WHERE p.id IS NOT NULL AND pfw.role = 'actor'),
-                    '[]'
-                ) AS actors,
-                COALESCE (
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'id', p.id,
-                            'name', p.full_name
-                        )
-                    ) FILTER (WHERE p.id IS NOT NULL AND pfw.role = 'writer'),
-                    '[]'
-                ) AS writers,
-                COALESCE (
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'id', p.id,
-                            'name', p.full_name
-                        )
-                    ) FILTER (WHERE p.id IS NOT NULL AND pfw.role = 'director'),
-                    '[]'
-                ) AS directors
-            FROM content.film_work fw
-            JOIN content.person_film_work pfw ON fw.id = pfw.film_work_id
-            JOIN content.person p ON p.id = pfw.person_id
-            WHERE EXISTS (
-                SELECT 1 FROM content.person p_sub
-                JOIN content.person_film_work pfw_sub ON p_sub.id = pfw_sub.person_id
-                {where_clause}
-            )
-            GROUP BY fw.id
-            ORDER BY MAX(p.modified);
+        checkpoint = from_checkpoint or INITIAL_CHECKPOINT
+        bounds = shard._asdict() if shard else {}
+
+        while True:
+            page_rows = 0
+            params = {"modified": checkpoint.modified, "id": checkpoint.id, "limit": ETL.PAGE_SIZE, **bounds}
+            for rows in self._fetch_batches(query, params, self.lookup_cursor):
+                page_rows += len(rows)
+                columns = tuple(column.name for column in self.lookup_cursor.description)
+                last = dict(zip(columns, rows[-1]))
+                checkpoint = Checkpoint(modified=last["modified"], id=last["id"])
+                yield ExtractedBatch(rows=rows, columns=columns, checkpoint=checkpoint)
+
+            # Закрываем транзакцию страницы, чтобы не держать ее открытой всю синхронизацию
+            self.pg_cursor.connection.commit()
+            if page_rows < ETL.PAGE_SIZE:
+                break
+
+    def _propagate(
+        self, changes_query: str, films_query: str, from_checkpoint: Checkpoint | None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Распространяет изменения связанных сущностей (персон, жанров) на фильмы.
+
+        Постранично читает изменившиеся с курсора сущности, и для каждой страницы одним
+        запросом заново собирает только те фильмы, в которых они участвуют. Так изменение
+        одной персоны стоит O(ее фильмов), а не O(каталога).
+
+        changes_query возвращает (modified, id) изменившихся сущностей с keyset-условием
+        как в _paginate, films_query собирает фильмы по списку сущностей %(ids)s.
+        Курсор несет только последняя пачка фильмов страницы, поэтому и состояние,
+        и бюджет запуска (RunBudget) останавливаются лишь на границе страницы.
         """
-        self.pg_cursor.execute(query)
-        while results := self.pg_cursor.fetchmany(BATCH_SIZE):
-            yield results
-
-    def extract_persons_data(self, from_ts: datetime = None) -> Generator[list[sqlite3.Row], None, None]:
-        """Метод для извлечения данных о персонах из БД"""
-        where_clause = f"WHERE p.modified > '{from_ts}'" if from_ts else ""
-
-        query = f"""
-            SELECT
-                p.id,
-                p.full_name,
-                MAX(p.modified) AS modified,
-                JSON_AGG(
-                    JSONB_BUILD_OBJECT(
-                        'id', pfw.film_work_id,
-                        'roles', roles_array
-                    )
-                ) AS films
-            FROM content.person p
-            JOIN (
-                SELECT
-                    pfw.person_id,
-                    pfw.film_work_id,
-                    ARRAY_AGG(pfw.role) AS roles_array
-                FROM content.person_film_work pfw
-                GROUP BY pfw.person_id, pfw.film_work_id
-            ) pfw ON p.id = pfw.person_id
-            {where_clause}
-            GROUP BY p.id
-            ORDER BY MAX(p.modified);
+        checkpoint = from_checkpoint or INITIAL_CHECKPOINT
+
+        while True:
+            params = {"modified": checkpoint.modified, "id": checkpoint.id, "limit": ETL.PAGE_SIZE}
+            self._execute(self.lookup_cursor, changes_query, params)
+            changed = self.lookup_cursor.fetchall()
+            if not changed:
+                self.pg_cursor.connection.commit()
+                break
+
+            page_checkpoint = Checkpoint(*changed[-1])
+            columns, pending = (), []
+            for rows in self._fetch_batches(films_query, {"ids": [entity_id for _, entity_id in changed]}):
+                columns = tuple(column.name for column in self.pg_cursor.description)
+                if pending:
+                    yield ExtractedBatch(rows=pending, columns=columns, checkpoint=None)
+                pending = rows
+            yield ExtractedBatch(rows=pending, columns=columns, checkpoint=page_checkpoint)
+
+            checkpoint = page_checkpoint
+            self.pg_cursor.connection.commit()
+            if len(changed) < ETL.PAGE_SIZE:
+                break
+
+    def _fan_out(
+        self, changes_query: str, targets: dict[str, str], from_checkpoint: Checkpoint | None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Один проход по изменившимся сущностям для нескольких индексов.
+
+        Как _propagate, но страница изменившихся сущностей читается один раз, а затем
+        по ее списку id %(ids)s выполняется запрос каждого индекса из targets
+        (индекс -> запрос). Пачки помечаются индексом, курсор страницы несет только
+        последняя пачка страницы.
+        """
+        checkpoint = from_checkpoint or INITIAL_CHECKPOINT
+
+        while True:
+            params = {"modified": checkpoint.modified, "id": checkpoint.id, "limit": ETL.PAGE_SIZE}
+            self._execute(self.lookup_cursor, changes_query, params)
+            changed = self.lookup_cursor.fetchall()
+            if not changed:
+                self.pg_cursor.connection.commit()
+                break
+
+            checkpoint = Checkpoint(*changed[-1])
+            ids = [entity_id for _, entity_id in changed]
+            pending = ExtractedBatch(rows=[], columns=(), checkpoint=None, index=next(iter(targets)))
+            for index, query in targets.items():
+                for rows in self._fetch_batches(query, {"ids": ids}):
+                    columns = tuple(column.name for column in self.pg_cursor.description)
+                    if pending.rows:
+                        yield pending
+                    pending = ExtractedBatch(rows=rows, columns=columns, checkpoint=None, index=index)
+            yield pending._replace(checkpoint=checkpoint)
+
+            self.pg_cursor.connection.commit()
+            if len(changed) < ETL.PAGE_SIZE:
+                break
+
+    def count_source(self, index: str) -> int:
+        """Количество записей в Postgres, из которых строится индекс"""
+        queries = {
+            ELASTIC.MOVIES_INDEX: "SELECT count(*) FROM content.film_work;",
+            ELASTIC.GENRES_INDEX: "SELECT count(DISTINCT genre_id) FROM content.genre_film_work;",
+            ELASTIC.PERSONS_INDEX: "SELECT count(DISTINCT person_id) FROM content.person_film_work;",
+        }
+        self._execute(self.lookup_cursor, queries[index])
+        (count,) = self.lookup_cursor.fetchone()
+        self.pg_cursor.connection.commit()
+        return count
+
+    def plan_stats(self) -> dict[str, dict[str, Any]]:
+        """Подготовленные операторы подключения: сколько раз каждый выполнен по общему и частным планам.
+
+        Рост custom_plans при постоянном generic_plans значит, что Postgres так и не
+        перешел на общий план и продолжает планировать запрос на каждом выполнении.
         """
-        self.pg_cursor.execute(query)
-        while results := self.pg_cursor.fetchmany(BATCH_SIZE):
-            yield results
+        self.lookup_cursor.execute(
+            "SELECT name, generic_plans, custom_plans FROM pg_prepared_statements WHERE NOT from_sql;"
+        )
+        stats = {
+            name: {"generic_plans": generic, "custom_plans": custom} for name, generic, custom in self.lookup_cursor
+        }
+        self.pg_cursor.connection.commit()
+        return stats
+
+    def _select(self, query: str, ids: list[str]) -> Generator[ExtractedBatch, None, None]:
+        """Читает строки по явному списку id, без сдвига состояния"""
+        for rows in self._fetch_batches(query, {"ids": ids}):
+            columns = tuple(column.name for column in self.pg_cursor.description)
+            yield ExtractedBatch(rows=rows, columns=columns, checkpoint=None)
+        self.pg_cursor.connection.commit()
+
+    def extract_movies_data(
+        self, from_checkpoint: Checkpoint = None, shard: Shard | None = None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения данных о фильмах из БД (всех или одного диапазона id)"""
+        yield from self._paginate(MOVIES_SHARD_QUERY if shard else MOVIES_QUERY, from_checkpoint, shard)
+
+    def extract_genres_from_films_data(
+        self, from_checkpoint: Checkpoint = None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения жанров фильмов, затронутых изменением жанров"""
+        if ETL.MOVIES_SOURCE == "search":
+            # Такие фильмы уже попали в основной проход по film_work_search
+            return
+        yield from self._propagate(CHANGED_GENRES_QUERY, FILM_GENRES_QUERY, from_checkpoint)
+
+    def extract_genres_data(
+        self, from_checkpoint: Checkpoint = None, shard: Shard | None = None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения данных о жанрах из БД (всех или одного диапазона id)"""
+        yield from self._paginate(GENRES_SHARD_QUERY if shard else GENRES_QUERY, from_checkpoint, shard)
+
+    def extract_persons_from_films_data(
+        self, from_checkpoint: Checkpoint = None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения персон фильмов, затронутых изменением персон"""
+        if ETL.MOVIES_SOURCE == "search":
+            return
+        yield from self._propagate(CHANGED_PERSONS_QUERY, FILM_PERSONS_QUERY, from_checkpoint)
+
+    def extract_persons_data(
+        self, from_checkpoint: Checkpoint = None, shard: Shard | None = None
+    ) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения данных о персонах из БД (всех или одного диапазона id)"""
+        yield from self._paginate(PERSONS_SHARD_QUERY if shard else PERSONS_QUERY, from_checkpoint, shard)
+
+    def extract_changed_genres(self, from_checkpoint: Checkpoint = None) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения изменившихся жанров сразу для индексов genres и movies"""
+        targets = {ELASTIC.GENRES_INDEX: GENRES_BY_IDS_QUERY}
+        if ETL.MOVIES_SOURCE == "tables":
+            targets[ELASTIC.MOVIES_INDEX] = FILM_GENRES_QUERY
+        yield from self._fan_out(CHANGED_GENRES_QUERY, targets, from_checkpoint)
+
+    def extract_changed_persons(self, from_checkpoint: Checkpoint = None) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения изменившихся персон сразу для индексов persons и movies"""
+        targets = {ELASTIC.PERSONS_INDEX: PERSONS_BY_IDS_QUERY}
+        if ETL.MOVIES_SOURCE == "tables":
+            targets[ELASTIC.MOVIES_INDEX] = FILM_PERSONS_QUERY
+        yield from self._fan_out(CHANGED_PERSONS_QUERY, targets, from_checkpoint)
+
+    def extract_movies_by_ids(self, ids: list[str]) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения данных о фильмах по списку id"""
+        yield from self._select(MOVIES_BY_IDS_QUERY, ids)
+
+    def extract_genres_by_ids(self, ids: list[str]) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения данных о жанрах по списку id"""
+        yield from self._select(GENRES_BY_IDS_QUERY, ids)
+
+    def extract_persons_by_ids(self, ids: list[str]) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения данных о персонах по списку id"""
+        yield from self._select(PERSONS_BY_IDS_QUERY, ids)
+
+    def extract_genres_from_films_by_ids(self, genre_ids: list[str]) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения жанров фильмов, в которых участвуют жанры из списка"""
+        yield from self._select(FILM_GENRES_QUERY, genre_ids)
+
+    def extract_persons_from_films_by_ids(self, person_ids: list[str]) -> Generator[ExtractedBatch, None, None]:
+        """Метод для извлечения персон фильмов, в которых участвуют персоны из списка"""
+        yield from self._select(FILM_PERSONS_QUERY, person_ids)
+
+
+def _names(persons: list[dict[str, Any]]) -> list[str]:
+    return [person["name"] for person in persons]
+
+
+def _person_films(films: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    return [{"uuid": film["id"], "roles": film["roles"]} for film in films]
+
+
+class DocumentMapper:
+    """Заранее скомпилированное отображение колонок выборки в поля документа Elasticsearch.
+
+    Позиции колонок вычисляются один раз на набор колонок запроса, дальше каждая строка
+    превращается в тело bulk-действия без создания промежуточных объектов. Колонки,
+    которых нет в запросе, и значения NULL в документ не попадают.
+    """
+
+    def __init__(
+        self,
+        fields: dict[str, str],
+        updates: UpdateBuilder,
+        converters: dict[str, Callable[[Any], Any]] | None = None,
+    ):
+        # Поле документа -> колонка выборки
+        self.fields = fields
+        self.updates = updates
+        self.converters = converters or {}
+        self._plans: dict[tuple[str, ...], tuple[tuple[str, int, Callable | None], ...]] = {}
+
+    def _plan(self, columns: tuple[str, ...]) -> tuple[tuple[str, int, Callable | None], ...]:
+        if (plan := self._plans.get(columns)) is None:
+            positions = {name: position for position, name in enumerate(columns)}
+            plan = tuple(
+                (field, positions[column], self.converters.get(field))
+                for field, column in self.fields.items()
+                if column in positions
+            )
+            self._plans[columns] = plan
+        return plan
+
+    def dump(self, rows: list[tuple], columns: tuple[str, ...]) -> list[RawDocument]:
+        if not rows:
+            return []
+        plan = self._plan(columns)
+        id_position = columns.index("id")
+        documents = []
+        for row in rows:
+            doc = {}
+            for field, position, convert in plan:
+                if (value := row[position]) is not None:
+                    doc[field] = convert(value) if convert else value
+            documents.append(RawDocument(id=row[id_position], body=self.updates.body(doc)))
+        return documents
+
+
+MOVIES_MAPPER = DocumentMapper(
+    fields={
+        "id": "id",
+        "imdb_rating": "rating",
+        "title": "title",
+        "description": "description",
+        "permissions": "permissions",
+        "genres": "genres",
+        "genre_ids": "genre_ids",
+        "actors": "actors",
+        "directors": "directors",
+        "writers": "writers",
+        "actors_names": "actors",
+        "directors_names": "directors",
+        "writers_names": "writers",
+    },
+    updates=MOVIES_UPDATES,
+    converters={"actors_names": _names, "directors_names": _names, "writers_names": _names},
+)
+GENRES_MAPPER = DocumentMapper(fields={"uuid": "id", "name": "name"}, updates=GENRES_UPDATES)
+PERSONS_MAPPER = DocumentMapper(
+    fields={"uuid": "id", "full_name": "full_name", "films": "films"},
+    updates=PERSONS_UPDATES,
+    converters={"films": _person_films},
+)
 
 
 class DataTransform:
-    def transform_movies(self, batch):
+    """Преобразование строк выборки в документы индексов.
+
+    В строгом режиме (strict) каждая строка валидируется pydantic-моделью. В доверенном
+    режиме (trusted) строки сразу сериализуются в тело bulk-действия через DocumentMapper.
+    """
+
+    def __init__(self, mode: str = ETL.TRANSFORM_MODE):
+        self.trusted = mode == "trusted"
+
+    def transform_movies(self, batch: list[tuple], columns: tuple[str, ...]):
         """Принимает список сырых данных (batch) и cписок моделей адаптированных под индекс movies"""
-        return [MoviesElasticsearchModel.model_validate(item) for item in batch]
+        if self.trusted:
+            return MOVIES_MAPPER.dump(batch, columns)
+        return [MoviesElasticsearchModel.model_validate(dict(zip(columns, item))) for item in batch]
 
-    def transform_genres(self, batch):
+    def transform_genres(self, batch: list[tuple], columns: tuple[str, ...]):
         """Принимает список сырых данных (batch) и cписок моделей адаптированных под индекс genres"""
-        return [GenresElasticsearchModel.model_validate(item) for item in batch]
+        if self.trusted:
+            return GENRES_MAPPER.dump(batch, columns)
+        return [GenresElasticsearchModel.model_validate(dict(zip(columns, item))) for item in batch]
 
-    def transform_persons(self, batch):
+    def transform_persons(self, batch: list[tuple], columns: tuple[str, ...]):
         """Принимает список сырых данных (batch) и cписок моделей адаптированных под индекс persons"""
-        return [PersonsElasticsearchModel.model_validate(item) for item in batch]
+        if self.trusted:
+            return PERSONS_MAPPER.dump(batch, columns)
+        return [PersonsElasticsearchModel.model_validate(dict(zip(columns, item))) for item in batch]
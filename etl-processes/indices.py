@@ -0,0 +1,89 @@
+import json
+import logging
+import re
+from pathlib import Path
+
+from configs.elastic import ELASTIC
+from elasticsearch import Elasticsearch
+
+
+class IndexManager:
+    """Версионированные индексы за алиасами.
+
+    Данные лежат в индексах вида movies_v1, movies_v2, ..., а API и инкрементальный ETL
+    работают с алиасом movies. Новая версия строится в фоне по схеме из es-schemas
+    и подключается атомарной сменой алиаса.
+    """
+
+    def __init__(self, elastic_client: Elasticsearch, schemas_dir: str = ELASTIC.SCHEMAS_DIR):
+        self.elastic_client = elastic_client
+        self.schemas_dir = Path(schemas_dir)
+
+    def versions(self, alias: str) -> list[str]:
+        """Существующие версии индекса, от старой к новой"""
+        pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+        indices = self.elastic_client.indices.get(index=f"{alias}_v*", allow_no_indices=True, expand_wildcards="all")
+        versions = [(int(match.group(1)), name) for name in indices if (match := pattern.match(name))]
+        return [name for _, name in sorted(versions)]
+
+    def current(self, alias: str) -> str | None:
+        """Индекс, на который сейчас указывает алиас (или одноименный индекс без версии)"""
+        if self.elastic_client.indices.exists_alias(name=alias):
+            return next(iter(self.elastic_client.indices.get_alias(name=alias)))
+        if self.elastic_client.indices.exists(index=alias):
+            return alias
+        return None
+
+    def create_next(self, alias: str) -> str:
+        """Создает следующую версию индекса по схеме из es-schemas/<alias>.json"""
+        versions = self.versions(alias)
+        last = int(versions[-1].rsplit("_v", 1)[1]) if versions else 0
+        index = f"{alias}_v{last + 1}"
+
+        schema = json.loads((self.schemas_dir / f"{alias}.json").read_text())
+        self.elastic_client.indices.create(index=index, settings=schema["settings"], mappings=schema["mappings"])
+        logging.info(f"Index {index} created for alias {alias}")
+        return index
+
+    def outdated(self, alias: str) -> bool:
+        """Собрана ли текущая версия индекса по более старой схеме, чем es-schemas/<alias>.json.
+
+        Версия схемы - mappings._meta.schema_version (нет - версия 1). Изменения, которые
+        требуют заново загрузить документы (новое поле, заполняемое ETL), повышают ее.
+        """
+        current = self.current(alias)
+        if current is None:
+            return False
+        schema = json.loads((self.schemas_dir / f"{alias}.json").read_text())
+        required = schema["mappings"].get("_meta", {}).get("schema_version", 1)
+        mapping = self.elastic_client.indices.get_mapping(index=current)[current]["mappings"]
+        return mapping.get("_meta", {}).get("schema_version", 1) < required
+
+    def count(self, index: str) -> int:
+        self.elastic_client.indices.refresh(index=index)
+        return self.elastic_client.count(index=index)["count"]
+
+    def swap(self, alias: str, index: str) -> None:
+        """Атомарно переключает алиас на index.
+
+        Если под именем алиаса пока лежит обычный индекс (схема до версионирования),
+        он удаляется в том же запросе, иначе алиас с таким именем создать нельзя.
+        """
+        current = self.current(alias)
+        actions = []
+        if current == alias:
+            actions.append({"remove_index": {"index": alias}})
+        elif current:
+            actions.append({"remove": {"index": current, "alias": alias}})
+        actions.append({"add": {"index": index, "alias": alias, "is_write_index": True}})
+
+        self.elastic_client.indices.update_aliases(actions=actions)
+        logging.info(f"Alias {alias} switched from {current} to {index}")
+
+    def drop_stale(self, alias: str, keep: int = ELASTIC.KEEP_VERSIONS) -> None:
+        """Удаляет старые версии, оставляя текущую и keep предыдущих для отката"""
+        current = self.current(alias)
+        stale = [index for index in self.versions(alias) if index != current]
+        for index in stale[: max(len(stale) - keep, 0)]:
+            self.elastic_client.indices.delete(index=index)
+            logging.info(f"Stale index {index} deleted")
@@ -0,0 +1,24 @@
+import logging
+
+import orjson
+import redis
+from configs.etl import ETL
+
+
+class CacheInvalidator:
+    """Публикует id документов, которые ETL изменил в индексе, для сброса кешей API.
+
+    Сообщение в канал ETL.INVALIDATION_CHANNEL - {"index": <алиас индекса>, "ids": [...]},
+    ids = None значит, что изменился весь индекс (например, после переключения алиаса).
+    Потеря сообщения не ломает ETL: кеш API в этом случае доживет до своего TTL.
+    """
+
+    def __init__(self, redis_client: redis.Redis, channel: str = ETL.INVALIDATION_CHANNEL):
+        self.redis_client = redis_client
+        self.channel = channel
+
+    def publish(self, index: str, ids: list[str] | None) -> None:
+        try:
+            self.redis_client.publish(self.channel, orjson.dumps({"index": index, "ids": ids}))
+        except redis.RedisError as e:
+            logging.warning(f"Couldn't publish cache invalidation for {index}: {e}")
@@ -0,0 +1,64 @@
+import json
+import logging
+import time
+from collections import defaultdict
+
+import psycopg
+from configs.etl import ETL
+from connector import postgres_connection
+from scheduler import app  # noqa: F401 - подключает задачи к брокеру
+
+from tasks import POLLING_TASKS, sync_changed_entities
+
+RECONNECT_DELAY = 5
+
+
+def collect_changes(connection: psycopg.Connection) -> dict[str, list[str]]:
+    """Ждет первое уведомление и в течение ETL.NOTIFY_DEBOUNCE секунд копит следующие.
+
+    Повторные изменения одной строки схлопываются, поэтому серия правок в админке
+    превращается в одну задачу синхронизации.
+    """
+    changes = defaultdict(set)
+    for notify in connection.notifies(timeout=60, stop_after=1):
+        change = json.loads(notify.payload)
+        changes[change["table"]].add(change["id"])
+
+    if changes:
+        for notify in connection.notifies(timeout=ETL.NOTIFY_DEBOUNCE, stop_after=ETL.NOTIFY_MAX_BATCH):
+            change = json.loads(notify.payload)
+            changes[change["table"]].add(change["id"])
+
+    return {table: sorted(ids) for table, ids in changes.items()}
+
+
+def listen() -> None:
+    """Слушает ленту изменений схемы content и отправляет измененные id в ETL.
+
+    Уведомления публикуют триггеры схемы content из миграции movies 0006_content_notify.
+    После (пере)подключения уведомления, пришедшие без слушателя, потеряны, поэтому
+    сразу, вне расписания, запускаются обычные задачи опроса, которые догоняют изменения
+    по состоянию.
+    """
+    while True:
+        try:
+            with postgres_connection(autocommit=True) as connection:
+                connection.execute(f"LISTEN {ETL.NOTIFY_CHANNEL}")
+                logging.info(f"Listening for changes on {ETL.NOTIFY_CHANNEL}")
+
+                for task in POLLING_TASKS:
+                    task.delay(force=True)
+
+                while True:
+                    if changes := collect_changes(connection):
+                        sync_changed_entities.delay(changes)
+                        counts = {table: len(ids) for table, ids in changes.items()}
+                        logging.info(f"Changes dispatched: {counts}")
+        except psycopg.OperationalError as e:
+            logging.error(f"🚨 Lost connection to postgres: {e}")
+            time.sleep(RECONNECT_DELAY)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    listen()
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Generator
+
+import psycopg
+import redis
+from configs.etl import ETL
+from connector import lock_connection, redis_client, release_lock_connection
+from metrics import LOCK_SKIPS
+from storage import advisory_unlock, try_advisory_lock
+
+# Время жизни лока без продления, секунды
+LOCK_TIMEOUT = 15
+
+# Захват лока и выдача следующего fencing-токена одной атомарной операцией
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return false
+"""
+
+# Продление и освобождение - только если лок все еще принадлежит владельцу токена
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LockLostError(Exception):
+    """Лок задачи истек или перешел к другому воркеру."""
+
+
+class LeaseLock:
+    """Лок в redis с арендой, которую продлевает фоновый поток.
+
+    Значение ключа - уникальный токен владельца, поэтому продлить и освободить лок
+    может только тот, кто его взял. Пока задача работает, поток-heartbeat продлевает
+    аренду каждые ttl / 3 секунд независимо от длительности отдельных bulk-запросов.
+    Если продлить не удалось, лок считается потерянным, и ensure() останавливает задачу.
+
+    При захвате выдается fencing-токен - монотонно растущий номер владельца. Его
+    сохраняет State, чтобы запись устаревшего владельца отклонялась (см. State.claim).
+    """
+
+    def __init__(self, redis_client: redis.Redis, key: str, ttl: float = LOCK_TIMEOUT):
+        self.redis_client = redis_client
+        self.key = key
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self.fence: int | None = None
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._renew = redis_client.register_script(RENEW_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._stopped = threading.Event()
+        self._lost = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+
+    def acquire(self, wait: float = 0) -> bool:
+        """Взять лок, ожидая его освобождения не дольше wait секунд"""
+        deadline = time.monotonic() + wait
+        while (fence := self._acquire(keys=[self.key, f"{self.key}_fence"], args=[self.token, self._ttl_ms])) is None:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(1)
+
+        self.fence = int(fence)
+        self._heartbeat = threading.Thread(target=self._renew_forever, name=f"lock-{self.key}", daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def release(self) -> None:
+        self._stopped.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        self._release(keys=[self.key], args=[self.token])
+
+    def ensure(self) -> None:
+        """Проверить, что лок все еще наш"""
+        if self._lost.is_set():
+            raise LockLostError(f"Lock {self.key} is lost")
+
+    @property
+    def _ttl_ms(self) -> int:
+        return int(self.ttl * 1000)
+
+    def _renew_forever(self) -> None:
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                renewed = self._renew(keys=[self.key], args=[self.token, self._ttl_ms])
+            except redis.RedisError as e:
+                # Следующая попытка может успеть до истечения аренды
+                logging.warning(f"Couldn't renew lock {self.key}: {e}")
+                continue
+            if not renewed:
+                logging.error(f"🚨 Lock {self.key} is lost!")
+                self._lost.set()
+                return
+
+
+class AdvisoryLock:
+    """Advisory-лок Postgres на сессию отдельного подключения.
+
+    Продлевать его не нужно: лок живет, пока живо подключение, и освобождается вместе
+    с ним при падении воркера. Fencing-токен - номер транзакции, в которой лок взят.
+    Сессии берутся из пула локов процесса (connector.lock_connection), поэтому задача
+    не открывает новое подключение на каждый лок.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.fence: int | None = None
+        self._connection: psycopg.Connection | None = None
+
+    def acquire(self, wait: float = 0) -> bool:
+        """Взять лок, ожидая его освобождения не дольше wait секунд"""
+        deadline = time.monotonic() + wait
+        self._connection = lock_connection()
+        while not try_advisory_lock(self._connection, self.key):
+            if time.monotonic() >= deadline:
+                release_lock_connection(self._connection)
+                return False
+            time.sleep(1)
+
+        self.fence = self._connection.execute("SELECT txid_current();").fetchone()[0]
+        return True
+
+    def release(self) -> None:
+        try:
+            if not self._connection.broken:
+                advisory_unlock(self._connection, self.key)
+        finally:
+            release_lock_connection(self._connection)
+
+    def ensure(self) -> None:
+        """Проверить, что лок все еще наш"""
+        if self._connection.closed or self._connection.broken:
+            raise LockLostError(f"Lock {self.key} is lost")
+
+
+@contextmanager
+def task_lock(lock_key: str, wait: float = 0) -> Generator[LeaseLock | AdvisoryLock | None, None, None]:
+    """Лок, чтобы не допустить наложения задач друг на друга. Отдает лок или None, если он занят.
+
+    С состоянием в Redis это LeaseLock, с состоянием в Postgres - AdvisoryLock.
+    wait - сколько секунд ждать освобождения занятого лока.
+    """
+    lock = AdvisoryLock(lock_key) if ETL.STATE_BACKEND == "postgres" else LeaseLock(redis_client, lock_key)
+    if not lock.acquire(wait):
+        LOCK_SKIPS.labels(lock=lock_key).inc()
+        yield None
+        return
+
+    try:
+        yield lock
+    finally:
+        lock.release()
@@ -0,0 +1,43 @@
+import os
+from pathlib import Path
+
+from configs.etl import ETL
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess, start_http_server
+
+# Метрики пишут все процессы-воркеры celery. С переменной окружения PROMETHEUS_MULTIPROC_DIR
+# prometheus_client хранит значения в файлах этого каталога, а сервер метрик их суммирует.
+
+ROWS = Counter("etl_rows", "Строки, прошедшие этап конвейера ETL", ["pipeline", "stage"])
+STAGE_SECONDS = Histogram(
+    "etl_stage_seconds",
+    "Время этапа конвейера ETL на одну пачку",
+    ["pipeline", "stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+BULK_ERRORS = Counter("etl_bulk_errors", "Документы, которые Elasticsearch отказался записать", ["index"])
+CHECKPOINT_LAG = Gauge(
+    "etl_checkpoint_lag_seconds",
+    "Отставание сохраненного курсора от текущего времени",
+    ["key"],
+    multiprocess_mode="mostrecent",
+)
+LOCK_SKIPS = Counter("etl_lock_skips", "Запуски, не взявшие лок, потому что он занят", ["lock"])
+
+
+def start_metrics_server(port: int = ETL.METRICS_PORT) -> None:
+    """Запускает HTTP-сервер /metrics в главном процессе воркера"""
+    registry = REGISTRY
+    if multiproc_dir := os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Файлы прошлого запуска воркера только исказят счетчики
+        Path(multiproc_dir).mkdir(parents=True, exist_ok=True)
+        for stale in Path(multiproc_dir).glob("*.db"):
+            stale.unlink()
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    start_http_server(port, registry=registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Убирает значения gauge завершившегося процесса-воркера"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+from configs.etl import ETL
+from etls import BulkResult, ExtractedBatch
+from metrics import ROWS, STAGE_SECONDS
+from storage import Checkpoint
+
+# Маркер конца потока данных между этапами конвейера
+_DONE = object()
+
+
+class RunBudget:
+    """Время, отведенное на один запуск задачи, общее для всех ее конвейеров.
+
+    exhausted = True, если конвейер остановился по истечении времени, не дочитав изменения.
+    """
+
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds
+        self.exhausted = False
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+class EtlPipeline:
+    """Конвейер extract -> transform -> load с ограниченными очередями между этапами.
+
+    Извлечение выполняется в вызывающем потоке, трансформация и загрузка - в отдельных
+    потоках, поэтому чтение из Postgres, валидация и индексация в Elasticsearch идут
+    одновременно. Ограниченный размер очередей дает обратное давление: быстрый этап
+    ждет медленный, а не копит пачки в памяти. Состояние сохраняется потоком загрузки
+    строго в порядке извлечения и только после успешной загрузки пачки.
+
+    Если Elasticsearch отклонил часть документов пачки, ни ее курсор, ни курсоры следующих
+    пачек уже не сохраняются: остальные пачки догружаются, а следующий запуск повторит
+    все, начиная с неудачной.
+
+    Если один проход наполняет несколько индексов, пачки помечены индексом (ExtractedBatch.index),
+    и для них трансформация и загрузка берутся из routes (индекс -> (transform, load)).
+
+    С budget конвейер перестает извлекать пачки, когда время запуска истекло. Останавливается
+    он только на пачке с курсором, поэтому каждый запуск продвигается хотя бы на один курсор.
+    """
+
+    def __init__(
+        self,
+        transform: Callable[[list, tuple[str, ...]], list] | None,
+        load: Callable[[list], BulkResult] | None,
+        commit: Callable[[Checkpoint], None],
+        queue_size: int = ETL.PIPELINE_QUEUE_SIZE,
+        routes: dict[str, tuple[Callable[[list, tuple[str, ...]], list], Callable[[list], BulkResult]]] | None = None,
+        name: str = "etl",
+        budget: RunBudget | None = None,
+    ):
+        # Имя конвейера в метриках
+        self.name = name
+        self.transform = transform
+        self.load = load
+        self.commit = commit
+        self.routes = routes or {}
+        self.budget = budget
+        self._transform_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._load_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+        self._loaded = 0
+        self._failed = 0
+
+    def run(self, batches: Iterable[ExtractedBatch]) -> int:
+        """Прогоняет пачки через конвейер. Возвращает количество успешно загруженных документов."""
+        workers = [
+            threading.Thread(target=self._transform_worker, name="etl-transform", daemon=True),
+            threading.Thread(target=self._load_worker, name="etl-load", daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            started = time.perf_counter()
+            for batch in batches:
+                self._observe("extract", started, len(batch.rows))
+                if not self._put(self._transform_queue, batch):
+                    break
+                if self.budget and batch.checkpoint is not None and self.budget.expired():
+                    self.budget.exhausted = True
+                    break
+                started = time.perf_counter()
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self._transform_queue, _DONE, force=True)
+            for worker in workers:
+                worker.join()
+
+        if self._error:
+            raise self._error
+        if self._failed:
+            logging.error(f"🚨 {self.name}: {self._failed} documents failed to load, checkpoint is held back")
+        return self._loaded
+
+    def _transform_worker(self) -> None:
+        try:
+            while (batch := self._transform_queue.get()) is not _DONE:
+                if self._stop.is_set():
+                    continue
+                transform, load = self.routes[batch.index] if batch.index else (self.transform, self.load)
+                started = time.perf_counter()
+                documents = transform(batch.rows, batch.columns)
+                self._observe("transform", started, len(documents))
+                self._put(self._load_queue, (load, documents, batch.checkpoint))
+        except BaseException as e:
+            self._fail(e)
+            self._drain(self._transform_queue)
+        finally:
+            self._put(self._load_queue, _DONE, force=True)
+
+    def _load_worker(self) -> None:
+        try:
+            while (item := self._load_queue.get()) is not _DONE:
+                if self._stop.is_set():
+                    continue
+                load, documents, checkpoint = item
+                started = time.perf_counter()
+                result = load(documents)
+                self._observe("load", started, len(documents))
+                self._loaded += result.success
+                self._failed += len(result.errors)
+                if checkpoint is not None and not self._failed:
+                    self.commit(checkpoint)
+        except BaseException as e:
+            self._fail(e)
+            self._drain(self._load_queue)
+
+    def _observe(self, stage: str, started: float, rows: int) -> None:
+        STAGE_SECONDS.labels(pipeline=self.name, stage=stage).observe(time.perf_counter() - started)
+        ROWS.labels(pipeline=self.name, stage=stage).inc(rows)
+
+    def _put(self, target: queue.Queue, item: Any, force: bool = False) -> bool:
+        """Кладет элемент в очередь, пока конвейер не остановлен ошибкой."""
+        while force or not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, source: queue.Queue) -> None:
+        """Вычитывает очередь до конца, чтобы разблокировать предыдущий этап."""
+        while source.get() is not _DONE:
+            pass
+
+    def _fail(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+        self._stop.set()
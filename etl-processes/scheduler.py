@@ -1,8 +1,20 @@
+import os
+
 from celery import Celery
+from celery.signals import beat_init, worker_init, worker_process_init, worker_process_shutdown
 from configs.celery import CELERY
+from configs.etl import ETL
 from configs.redis import REDIS
+from connector import close_postgres_pool, open_postgres_pool
+from metrics import mark_process_dead, start_metrics_server
 
-from tasks import update_genres_index, update_movies_index, update_persons_index
+from tasks import (
+    rebuild_outdated_indices,
+    sync_content,
+    update_genres_index,
+    update_movies_index,
+    update_persons_index,
+)
 
 app = Celery(
     broker=REDIS.URI,
@@ -13,20 +25,51 @@ app.config_from_object(CELERY.model_dump())
 app.autodiscover_tasks()
 
 
+@worker_init.connect
+def start_metrics(**kwargs):
+    start_metrics_server()
+
+
+@beat_init.connect
+def rebuild_outdated(**kwargs):
+    # Beat запущен в одном экземпляре, поэтому проверка схем выполняется один раз на развертывание
+    rebuild_outdated_indices()
+
+
+@worker_process_init.connect
+def open_connections(**kwargs):
+    # Пул создается в каждом процессе-воркере после fork, а не в родительском процессе
+    open_postgres_pool()
+
+
+@worker_process_shutdown.connect
+def close_connections(**kwargs):
+    close_postgres_pool()
+    mark_process_dead(os.getpid())
+
+
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
+    if ETL.UNIFIED_SYNC:
+        sender.add_periodic_task(
+            ETL.POLL_INTERVAL,
+            sync_content.s(),
+            name="Check for updates in all indices.",
+        )
+        return
+
     sender.add_periodic_task(
-        15.0,
+        ETL.POLL_INTERVAL,
         update_movies_index.s(),
         name="Check for updates in movies index.",
     )
     sender.add_periodic_task(
-        15.0,
+        ETL.POLL_INTERVAL,
         update_genres_index.s(),
         name="Check for updates in genres index.",
     )
     sender.add_periodic_task(
-        15.0,
+        ETL.POLL_INTERVAL,
         update_persons_index.s(),
         name="Check for updates in persons index.",
     )
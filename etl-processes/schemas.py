@@ -24,6 +24,7 @@ class MoviesElasticsearchModel(BaseModel):
     rating: float | None = Field(None, description="Рейтинг", serialization_alias="imdb_rating")
 
     genres: list[str] | None = Field(None, description="Список жанров")
+    genre_ids: list[UUID] | None = Field(None, description="Список ID жанров")
     actors: list[PersonModel] | None = Field(None, description="Список актеров в фильме")
     directors: list[PersonModel] | None = Field(None, description="Список директоров в фильме")
     writers: list[PersonModel] | None = Field(None, description="Список сценаристов в фильме")
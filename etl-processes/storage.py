@@ -1,9 +1,37 @@
 import abc
 import json
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, NamedTuple
+from uuid import UUID
 
+import psycopg
+from psycopg.types.json import Jsonb
 from redis import Redis
+from redis.client import Pipeline
+
+# Атомарная запись полей хеша. ARGV - четверки (поле, проверять ли, ожидаемое значение, новое значение):
+# если хоть одно проверяемое поле изменилось, ничего не записывается
+COMPARE_AND_SET_SCRIPT = """
+for i = 1, #ARGV, 4 do
+    if ARGV[i + 1] == '1' and (redis.call('HGET', KEYS[1], ARGV[i]) or '') ~= ARGV[i + 2] then
+        return 0
+    end
+end
+for i = 1, #ARGV, 4 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 3])
+end
+return 1
+"""
+
+
+class Checkpoint(NamedTuple):
+    """Курсор keyset-пагинации: последняя обработанная пара (modified, id)."""
+
+    modified: datetime
+    id: UUID
+
+
+INITIAL_CHECKPOINT = Checkpoint(modified=datetime.min, id=UUID(int=0))
 
 
 class BaseStorage(abc.ABC):
@@ -23,6 +51,23 @@ class BaseStorage(abc.ABC):
     def retrieve_state(self) -> Dict[str, Any]:
         """Получить состояние из хранилища."""
 
+    def retrieve_value(self, key: str) -> Any:
+        """Получить значение одного ключа состояния."""
+        return self.retrieve_state().get(key)
+
+    def save_values(self, values: Dict[str, Any], expected: Dict[str, Any] | None = None) -> bool:
+        """Сохранить значения ключей состояния.
+
+        Если передан expected, значения записываются, только если текущие значения этих
+        ключей совпадают с ожидаемыми (None - ключа нет). Возвращает, была ли запись.
+        """
+        state = self.retrieve_state()
+        if any(state.get(key) != value for key, value in (expected or {}).items()):
+            return False
+        state.update(values)
+        self.save_state(state)
+        return True
+
 
 class RedisStorage(BaseStorage):
     """Реализация хранилища, использующего redis."""
@@ -41,20 +86,246 @@ class RedisStorage(BaseStorage):
         return state_json and json.loads(state_json) or {}
 
 
+class RedisHashStorage(BaseStorage):
+    """Реализация хранилища на хеше redis: каждый ключ состояния - отдельное поле.
+
+    Чтение и запись одного ключа - одна команда (HGET/HSET) без перезаписи всего
+    состояния, а запись с проверкой ожидаемых значений выполняется атомарно Lua-скриптом.
+    Состояние, сохраненное RedisStorage под тем же ключом, переносится в хеш при первом
+    обращении.
+    """
+
+    def __init__(self, redis_client: Redis, state_key: str) -> None:
+        self.redis_client = redis_client
+        self.state_key = state_key
+        self._compare_and_set = redis_client.register_script(COMPARE_AND_SET_SCRIPT)
+        self._migrated = False
+
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        # Одинаковые значения всегда дают одинаковую строку - на этом построено сравнение в Lua
+        return json.dumps(value, sort_keys=True)
+
+    def _migrate(self) -> None:
+        """Переносит состояние из JSON-строки (формат RedisStorage) в хеш"""
+        if self._migrated:
+            return
+
+        def migrate(pipe: Pipeline) -> None:
+            if pipe.type(self.state_key) != "string":
+                return
+            state = json.loads(pipe.get(self.state_key) or "{}")
+            pipe.multi()
+            pipe.delete(self.state_key)
+            if state:
+                pipe.hset(self.state_key, mapping={key: self._dumps(value) for key, value in state.items()})
+
+        self.redis_client.transaction(migrate, self.state_key)
+        self._migrated = True
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Сохранить состояние в хранилище."""
+        self._migrate()
+        with self.redis_client.pipeline() as pipe:
+            pipe.delete(self.state_key)
+            if state:
+                pipe.hset(self.state_key, mapping={key: self._dumps(value) for key, value in state.items()})
+            pipe.execute()
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Получить состояние из хранилища."""
+        self._migrate()
+        return {key: json.loads(value) for key, value in self.redis_client.hgetall(self.state_key).items()}
+
+    def retrieve_value(self, key: str) -> Any:
+        """Получить значение одного ключа состояния."""
+        self._migrate()
+        value = self.redis_client.hget(self.state_key, key)
+        return value and json.loads(value)
+
+    def save_values(self, values: Dict[str, Any], expected: Dict[str, Any] | None = None) -> bool:
+        """Сохранить значения ключей состояния (см. BaseStorage.save_values)."""
+        self._migrate()
+        if expected is None:
+            self.redis_client.hset(self.state_key, mapping={key: self._dumps(value) for key, value in values.items()})
+            return True
+
+        args = []
+        for key, value in values.items():
+            checked = key in expected
+            current = expected.get(key)
+            args += [key, int(checked), "" if current is None else self._dumps(current), self._dumps(value)]
+        return bool(self._compare_and_set(keys=[self.state_key], args=args))
+
+
+class PostgresStorage(BaseStorage):
+    """Реализация хранилища на таблице Postgres: строка на каждый ключ состояния.
+
+    Таблица создается миграцией movies 0005_etl_state в admin-panel. Подключение должно
+    быть отдельным и в режиме autocommit: каждая запись - своя короткая транзакция,
+    которая фиксируется сразу и не зависит от транзакций извлечения.
+    """
+
+    def __init__(self, connection: psycopg.Connection, state_key: str, table: str = "content.etl_state") -> None:
+        self.connection = connection
+        self.state_key = state_key
+        self.table = table
+
+    def _upsert(self, values: Dict[str, Any]) -> None:
+        # Все ключи одной командой: пары разворачиваются из jsonb на стороне Postgres
+        self.connection.execute(
+            f"""
+            INSERT INTO {self.table} (state_key, key, value)
+            SELECT %(state_key)s, item.key, item.value FROM jsonb_each(%(values)s) AS item
+            ON CONFLICT (state_key, key) DO UPDATE SET value = EXCLUDED.value, modified = now();
+            """,
+            {"state_key": self.state_key, "values": Jsonb(values)},
+        )
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Сохранить состояние в хранилище."""
+        with self.connection.transaction():
+            self.connection.execute(f"DELETE FROM {self.table} WHERE state_key = %s;", (self.state_key,))
+            if state:
+                self._upsert(state)
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Получить состояние из хранилища."""
+        rows = self.connection.execute(
+            f"SELECT key, value FROM {self.table} WHERE state_key = %s;", (self.state_key,)
+        ).fetchall()
+        return dict(rows)
+
+    def retrieve_value(self, key: str) -> Any:
+        """Получить значение одного ключа состояния."""
+        row = self.connection.execute(
+            f"SELECT value FROM {self.table} WHERE state_key = %s AND key = %s;", (self.state_key, key)
+        ).fetchone()
+        return row and row[0]
+
+    def save_values(self, values: Dict[str, Any], expected: Dict[str, Any] | None = None) -> bool:
+        """Сохранить значения ключей состояния (см. BaseStorage.save_values)."""
+        saved = True
+        with self.connection.transaction():
+            if expected:
+                # FOR UPDATE не блокирует еще не существующие строки, поэтому сначала вставляются
+                # заглушки (JSON null читается как отсутствующий ключ): конкурирующая вставка той же
+                # строки ждет конца этой транзакции, и проверки двух процессов не проходят одновременно
+                self.connection.execute(
+                    f"""
+                    INSERT INTO {self.table} (state_key, key, value)
+                    SELECT %s, key, 'null'::jsonb FROM unnest(%s::text[]) AS key
+                    ON CONFLICT (state_key, key) DO NOTHING;
+                    """,
+                    (self.state_key, list(expected)),
+                )
+                rows = self.connection.execute(
+                    f"SELECT key, value FROM {self.table} WHERE state_key = %s AND key = ANY(%s) FOR UPDATE;",
+                    (self.state_key, list(expected)),
+                ).fetchall()
+                current = dict(rows)
+                if any(current.get(key) != value for key, value in expected.items()):
+                    # Откат убирает и вставленные заглушки
+                    saved = False
+                    raise psycopg.Rollback()
+            self._upsert(values)
+        return saved
+
+
+def try_advisory_lock(connection: psycopg.Connection, name: str) -> bool:
+    """Захватить advisory-лок на время сессии подключения, не дожидаясь его освобождения."""
+    return connection.execute("SELECT pg_try_advisory_lock(hashtext(%s));", (name,)).fetchone()[0]
+
+
+def advisory_unlock(connection: psycopg.Connection, name: str) -> None:
+    """Освободить advisory-лок (он освобождается и при закрытии подключения)."""
+    connection.execute("SELECT pg_advisory_unlock(hashtext(%s));", (name,))
+
+
+class StateConflictError(Exception):
+    """Состояние изменено другим процессом с момента последнего чтения."""
+
+
 class State:
-    """Класс для работы с состояниями."""
+    """Класс для работы с состояниями.
 
-    def __init__(self, storage: BaseStorage) -> None:
+    Значения, прочитанные через State, запоминаются, и запись проходит только если
+    в хранилище они не изменились (compare-and-set) - иначе StateConflictError.
+    С write_behind записи копятся в памяти до flush(), который сохраняет их
+    одним запросом - его вызывают на границе пачки.
+    """
+
+    def __init__(self, storage: BaseStorage, write_behind: bool = False) -> None:
         self.storage = storage
+        self.write_behind = write_behind
+        self._pending: Dict[str, Any] = {}
+        self._known: Dict[str, Any] = {}
+        self._fences: Dict[str, int] = {}
+
+    def claim(self, lock_key: str, fence: int) -> None:
+        """Закрепить состояние за владельцем лока lock_key с fencing-токеном fence.
+
+        Токен сохраняется рядом с курсорами, и каждая следующая запись проверяет, что
+        он не изменился. Когда лок переходит к новому владельцу, тот записывает больший
+        токен, и записи устаревшего владельца отклоняются, даже если он еще работает.
+        """
+        key = f"{lock_key}_fence"
+        current = self.storage.retrieve_value(key)
+        if current is not None and current > fence:
+            raise StateConflictError(f"State is claimed by a newer owner of {lock_key}: {current} > {fence}")
+        if not self.storage.save_values({key: fence}, expected={key: current}):
+            raise StateConflictError(f"State is claimed by another owner of {lock_key}")
+        self._fences[key] = fence
+
+    def _get(self, key: str) -> Any:
+        if key in self._pending:
+            return self._pending[key]
+        value = self._known[key] = self.storage.retrieve_value(key)
+        return value
+
+    def _set(self, key: str, value: Any) -> None:
+        self._pending[key] = value
+        if not self.write_behind:
+            self.flush()
+
+    def flush(self) -> None:
+        """Сохранить накопленные значения."""
+        if not self._pending:
+            return
+        values = dict(self._pending)
+        expected = {key: self._known[key] for key in self._pending if key in self._known}
+        for fence_key, fence in self._fences.items():
+            values[fence_key] = expected[fence_key] = fence
+        if not self.storage.save_values(values, expected=expected):
+            raise StateConflictError(f"State {sorted(self._pending)} was changed by another process")
+        self._known.update(self._pending)
+        self._pending = {}
+
+    def restore(self, values: Dict[str, Any]) -> None:
+        """Вернуть ключам значения в формате хранилища, например из ранее снятого снимка состояния."""
+        for key, value in values.items():
+            self._get(key)
+            self._set(key, value)
 
     def set_state(self, key: str, value: datetime) -> None:
         """Установить состояние для определённого ключа."""
-        state = self.storage.retrieve_state()
-        state[key] = value.isoformat()
-        self.storage.save_state(state)
+        self._set(key, value.isoformat())
 
     def get_state(self, key: str) -> datetime | None:
         """Получить состояние по определённому ключу."""
-        state = self.storage.retrieve_state().get(key, None)
+        state = self._get(key)
         if state:
             return datetime.fromisoformat(state)
+
+    def set_checkpoint(self, key: str, value: Checkpoint) -> None:
+        """Сохранить курсор keyset-пагинации для определённого ключа."""
+        self._set(key, {"modified": value.modified.isoformat(), "id": str(value.id)})
+
+    def get_checkpoint(self, key: str) -> Checkpoint | None:
+        """Получить курсор keyset-пагинации по определённому ключу."""
+        state = self._get(key)
+        if isinstance(state, str):
+            # Состояние в старом формате хранит только дату
+            return Checkpoint(modified=datetime.fromisoformat(state), id=INITIAL_CHECKPOINT.id)
+        if state:
+            return Checkpoint(modified=datetime.fromisoformat(state["modified"]), id=UUID(state["id"]))
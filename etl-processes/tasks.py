@@ -1,17 +1,34 @@
 import logging
-from contextlib import closing
+import time
+from contextlib import ExitStack, closing, contextmanager
+from datetime import datetime, timezone
+from functools import partial, wraps
+from typing import Callable, Generator, NamedTuple
 
 import elastic_transport
-from celery import shared_task
+from celery import chord, current_task, shared_task
 from configs.elastic import ELASTIC
-from connector import elastic_client, postgres_connector, redis_client
+from configs.etl import ETL
+from connector import (
+    cache_redis_client,
+    elastic_client,
+    postgres_connection,
+    postgres_connector,
+    postgres_cursor,
+    redis_client,
+)
 from etls import (
     DataTransform,
     ElasticsearchUploader,
     PostgresExtractor,
+    id_shards,
 )
-from psycopg.rows import dict_row
-from storage import RedisStorage, State
+from indices import IndexManager
+from invalidation import CacheInvalidator
+from locks import AdvisoryLock, LeaseLock, task_lock
+from metrics import CHECKPOINT_LAG
+from pipeline import EtlPipeline, RunBudget
+from storage import Checkpoint, PostgresStorage, RedisHashStorage, RedisStorage, State
 
 MOVIES_LOCK_KEY = "update_movies_index_lock"
 GENRES_LOCK_KEY = "update_genres_index_lock"
@@ -19,15 +36,217 @@ PERSONS_LOCK_KEY = "update_persons_index_lock"
 FILM_WORKS_LAST_CHECK_KEY = "film_works_last_check"
 GENRES_LAST_CHECK_KEY = "genres_last_check"
 PERSONS_LAST_CHECK_KEY = "persons_last_check"
-LOCK_TIMEOUT = 15
+CONTENT_STATE_KEY = "content_sync"
+LOCK_WAIT_TIMEOUT = 5 * 60
+SYNC_MAX_RETRIES = 60
+
+# Изменения инкрементальных задач сбрасывают кеш API
+cache_invalidator = CacheInvalidator(cache_redis_client)
+
+
+class IndexSource(NamedTuple):
+    """Как собирается индекс целиком и какой инкрементальной задаче он принадлежит"""
+
+    extract: str
+    transform: str
+    load: str
+    lock_key: str
+    state_key: str
+    check_key: str
+    # Курсоры инкрементальной задачи, изменения по которым попадают в индекс
+    cursor_keys: tuple[str, ...]
+
+
+INDEX_SOURCES = {
+    ELASTIC.MOVIES_INDEX: IndexSource(
+        extract="extract_movies_data",
+        transform="transform_movies",
+        load="bulk_update_movies",
+        lock_key=MOVIES_LOCK_KEY,
+        state_key="movies_sync",
+        check_key=FILM_WORKS_LAST_CHECK_KEY,
+        # Документы content.film_work_search пересобираются триггерами, и их modified сдвигается
+        # при изменении персон и жанров фильма
+        cursor_keys=(
+            (FILM_WORKS_LAST_CHECK_KEY,)
+            if ETL.MOVIES_SOURCE == "search"
+            else (FILM_WORKS_LAST_CHECK_KEY, GENRES_LAST_CHECK_KEY, PERSONS_LAST_CHECK_KEY)
+        ),
+    ),
+    ELASTIC.GENRES_INDEX: IndexSource(
+        extract="extract_genres_data",
+        transform="transform_genres",
+        load="bulk_update_genres",
+        lock_key=GENRES_LOCK_KEY,
+        state_key="genres_sync",
+        check_key=GENRES_LAST_CHECK_KEY,
+        cursor_keys=(GENRES_LAST_CHECK_KEY,),
+    ),
+    ELASTIC.PERSONS_INDEX: IndexSource(
+        extract="extract_persons_data",
+        transform="transform_persons",
+        load="bulk_update_persons",
+        lock_key=PERSONS_LOCK_KEY,
+        state_key="persons_sync",
+        check_key=PERSONS_LAST_CHECK_KEY,
+        cursor_keys=(PERSONS_LAST_CHECK_KEY,),
+    ),
+}
+
+
+class SyncPass(NamedTuple):
+    """Точечное обновление документов индекса по списку id из ленты изменений"""
+
+    lock_key: str
+    extract: str
+    ids: list[str]
+    transform: str
+    load: str
+
+
+def checkpoint_committer(state: State, key: str, lock: LeaseLock | AdvisoryLock) -> Callable[[Checkpoint], None]:
+    """Сохраняет курсор после загрузки пачки, если задача все еще владеет локом"""
+
+    def commit(checkpoint: Checkpoint) -> None:
+        lock.ensure()
+        state.set_checkpoint(key=key, value=checkpoint)
+        state.flush()
+        # modified хранится в UTC без часового пояса
+        lag = datetime.now(timezone.utc).replace(tzinfo=None) - checkpoint.modified
+        CHECKPOINT_LAG.labels(key=key).set(lag.total_seconds())
+
+    return commit
+
+
+@contextmanager
+def sync_state(state_key: str, lock: LeaseLock | AdvisoryLock | None = None) -> Generator[State, None, None]:
+    """Состояние задачи в хранилище, выбранном в ETL.STATE_BACKEND, закрепленное за владельцем lock"""
+    if ETL.STATE_BACKEND == "postgres":
+        with postgres_connection(autocommit=True) as connection:
+            state = State(PostgresStorage(connection, state_key=state_key), write_behind=True)
+            if lock:
+                state.claim(lock.key, lock.fence)
+            yield state
+    else:
+        state = State(RedisHashStorage(redis_client=redis_client, state_key=state_key), write_behind=True)
+        if lock:
+            state.claim(lock.key, lock.fence)
+        yield state
+
+
+def seed_from_index_states(state: State) -> None:
+    """Переносит курсоры задач отдельных индексов в состояние sync_content при первом запуске.
+
+    Для каждого курсора берется наименьший из курсоров тех задач, которые его вели, чтобы
+    ни один индекс не пропустил изменения. Если курсоров нет - будет полная переиндексация.
+    """
+    sources = {
+        FILM_WORKS_LAST_CHECK_KEY: ("movies_sync",),
+        GENRES_LAST_CHECK_KEY: ("movies_sync", "genres_sync"),
+        PERSONS_LAST_CHECK_KEY: ("movies_sync", "persons_sync"),
+    }
+    for key, state_keys in sources.items():
+        if state.get_checkpoint(key=key) is not None:
+            continue
+        legacy = []
+        for state_key in state_keys:
+            with sync_state(state_key) as index_state:
+                legacy.append(index_state.get_checkpoint(key=key))
+        if legacy and all(legacy):
+            state.set_checkpoint(key=key, value=min(legacy))
+    state.flush()
+
+
+def next_delay(previous: float, processed: int, duration: float, backlog: bool) -> float:
+    """Пауза до следующего запуска периодической задачи.
+
+    Если запуск остановился по бюджету времени (ETL.RUN_TIME_LIMIT), не дочитав изменения, -
+    следующий запуск сразу. Иначе все изменения уже выбраны, сколько бы их ни было. Если
+    они были, пауза не короче самого запуска: чем медленнее обрабатываются строки, тем реже
+    запуски, и задача занимает Postgres не больше половины времени даже при непрерывном потоке
+    изменений. Если изменений не было, пауза удваивается до ETL.POLL_MAX_INTERVAL.
+    """
+    if backlog:
+        return 0.0
+    if processed:
+        return min(max(ETL.POLL_INTERVAL, duration), ETL.POLL_MAX_INTERVAL)
+    return min(max(previous * 2, ETL.POLL_INTERVAL), ETL.POLL_MAX_INTERVAL)
+
+
+def adaptive_schedule(func: Callable[..., int | None]) -> Callable[..., int | None]:
+    """Адаптивное расписание периодической задачи.
+
+    Beat запускает задачу каждые ETL.POLL_INTERVAL секунд, но она выполняется, только
+    когда подошло время следующего запуска. Задача получает budget - время на запуск,
+    которое передает своим конвейерам, и возвращает количество обработанных строк
+    (None - запуск не состоялся). По нему, длительности запуска и тому, исчерпан ли бюджет,
+    считается пауза до следующего (см. next_delay). force=True запускает задачу вне расписания.
+    """
+
+    @wraps(func)
+    def wrapper(*args, force: bool = False, **kwargs) -> int | None:
+        schedule = RedisHashStorage(redis_client=redis_client, state_key=f"{func.__name__}_schedule")
+        planned = schedule.retrieve_state()
+        if not force and time.time() < planned.get("next_run_at", 0):
+            return None
+
+        started = time.monotonic()
+        budget = RunBudget(ETL.RUN_TIME_LIMIT)
+        processed = func(*args, budget=budget, **kwargs)
+        if processed is None:
+            return None
+
+        duration = time.monotonic() - started
+        delay = next_delay(planned.get("delay", 0.0), processed, duration, budget.exhausted)
+        schedule.save_values(
+            {"next_run_at": time.time() + delay, "delay": delay, "processed": processed, "duration": duration}
+        )
+        logging.info(
+            f"{func.__name__}: {processed=} in {duration:.1f}s, backlog={budget.exhausted}, next run in {delay:.0f}s"
+        )
+        if budget.exhausted:
+            current_task.apply_async()
+        return processed
+
+    return wrapper
+
+
+def live_state_key(source: IndexSource) -> str:
+    """Состояние инкрементальной задачи, которая сейчас ведет индекс"""
+    return CONTENT_STATE_KEY if ETL.UNIFIED_SYNC else source.state_key
+
+
+def bulk_settings_backup(index: str) -> RedisStorage:
+    """Исходные настройки индекса на время полной переиндексации"""
+    return RedisStorage(redis_client=redis_client, state_key=f"{index}_bulk_settings")
+
+
+@contextmanager
+def loading_mode(
+    uploader: ElasticsearchUploader, index: str, full_reindex: bool, budget: RunBudget | None = None
+) -> Generator[None, None, None]:
+    """Режим загрузки индекса.
+
+    При полной переиндексации отключает refresh и реплики. Переиндексация может занять
+    несколько запусков, если не укладывается в budget, и сохраненные исходные настройки
+    (bulk_settings_backup) служат маркером незаконченной переиндексации: следующие запуски
+    видят курсор, но продолжают в том же режиме. Настройки возвращаются, а сегменты
+    сливаются только после запуска, который без ошибок дочитал все изменения.
+    """
+    backup = bulk_settings_backup(index)
+    if full_reindex:
+        uploader.enable_bulk_indexing(index, backup)
+    yield
+    if budget is None or not budget.exhausted:
+        uploader.restore_index_settings(index, backup)
 
 
 @shared_task()
-def update_movies_index():
+@adaptive_schedule
+def update_movies_index(budget: RunBudget | None = None):
     """Задача на обновление данных в индексе movies"""
-    uploader = ElasticsearchUploader(elastic_client)
+    uploader = ElasticsearchUploader(elastic_client, invalidator=cache_invalidator)
     data_transformer = DataTransform()
-    state = State(RedisStorage(redis_client=redis_client, state_key="movies_sync"))
 
     try:
         if not elastic_client.indices.exists(index=ELASTIC.MOVIES_INDEX):
@@ -37,54 +256,57 @@ def update_movies_index():
         logging.error("🚨 Couldn't connect to elastic!")
         return
 
-    #  Лок, чтобы не допустить наложения задач друг на друга
-    if not redis_client.set(name=MOVIES_LOCK_KEY, value=1, nx=True, ex=15):
-        logging.warning("Task already running. Skipping execution.")
-        return
+    with task_lock(MOVIES_LOCK_KEY) as lock, sync_state("movies_sync", lock) as state:
+        if not lock:
+            logging.warning("Task already running. Skipping execution.")
+            return
 
-    try:
-        with postgres_connector() as postgres_conn:
-            with closing(postgres_conn.cursor(row_factory=dict_row)) as postgres_cursor:
-                loader = PostgresExtractor(pg_cursor=postgres_cursor)
-                updated_films, updated_persons, updated_genres = 0, 0, 0
-
-                for batch in loader.extract_movies_data(from_ts=state.get_state(key=FILM_WORKS_LAST_CHECK_KEY)):
-                    film_works = data_transformer.transform_movies(batch)
-                    uploader.bulk_update_movies(data=film_works)
-                    if film_works:
-                        state.set_state(key=FILM_WORKS_LAST_CHECK_KEY, value=film_works[-1].updated_at)
-                    updated_films += len(film_works)
-                    redis_client.expire(MOVIES_LOCK_KEY, LOCK_TIMEOUT)
-
-                for batch in loader.extract_genres_from_films_data(from_ts=state.get_state(key=GENRES_LAST_CHECK_KEY)):
-                    film_works = data_transformer.transform_movies(batch)
-                    uploader.bulk_update_movies(data=film_works)
-                    if film_works:
-                        state.set_state(key=GENRES_LAST_CHECK_KEY, value=film_works[-1].updated_at)
-                    updated_genres += len(film_works)
-                    redis_client.expire(MOVIES_LOCK_KEY, LOCK_TIMEOUT)
-
-                for batch in loader.extract_persons_from_films_data(
-                    from_ts=state.get_state(key=PERSONS_LAST_CHECK_KEY)
-                ):
-                    film_works = data_transformer.transform_movies(batch)
-                    uploader.bulk_update_movies(data=film_works)
-                    if film_works:
-                        state.set_state(key=PERSONS_LAST_CHECK_KEY, value=film_works[-1].updated_at)
-                    updated_persons += len(film_works)
-                    redis_client.expire(MOVIES_LOCK_KEY, LOCK_TIMEOUT)
+        full_reindex = state.get_checkpoint(key=FILM_WORKS_LAST_CHECK_KEY) is None
+        with postgres_connector() as postgres_conn, loading_mode(uploader, ELASTIC.MOVIES_INDEX, full_reindex, budget):
+            with closing(postgres_cursor(postgres_conn, name="movies_extractor")) as pg_cursor:
+                loader = PostgresExtractor(pg_cursor=pg_cursor)
+                updated_films = EtlPipeline(
+                    transform=data_transformer.transform_movies,
+                    load=uploader.bulk_update_movies,
+                    commit=checkpoint_committer(state, key=FILM_WORKS_LAST_CHECK_KEY, lock=lock),
+                    name="movies",
+                    budget=budget,
+                ).run(loader.extract_movies_data(from_checkpoint=state.get_checkpoint(key=FILM_WORKS_LAST_CHECK_KEY)))
+
+                updated_genres = EtlPipeline(
+                    transform=data_transformer.transform_movies,
+                    load=uploader.bulk_update_movies,
+                    commit=checkpoint_committer(state, key=GENRES_LAST_CHECK_KEY, lock=lock),
+                    name="movie_genres",
+                    budget=budget,
+                ).run(
+                    loader.extract_genres_from_films_data(
+                        from_checkpoint=state.get_checkpoint(key=GENRES_LAST_CHECK_KEY)
+                    )
+                )
+
+                updated_persons = EtlPipeline(
+                    transform=data_transformer.transform_movies,
+                    load=uploader.bulk_update_movies,
+                    commit=checkpoint_committer(state, key=PERSONS_LAST_CHECK_KEY, lock=lock),
+                    name="movie_persons",
+                    budget=budget,
+                ).run(
+                    loader.extract_persons_from_films_data(
+                        from_checkpoint=state.get_checkpoint(key=PERSONS_LAST_CHECK_KEY)
+                    )
+                )
 
                 logging.info(f"{updated_films=}, {updated_persons=}, {updated_genres=}, ")
-    finally:
-        redis_client.delete(MOVIES_LOCK_KEY)
+                return updated_films + updated_genres + updated_persons
 
 
 @shared_task()
-def update_genres_index():
+@adaptive_schedule
+def update_genres_index(budget: RunBudget | None = None):
     """Задача на обновление данных в индексе genres"""
-    uploader = ElasticsearchUploader(elastic_client)
+    uploader = ElasticsearchUploader(elastic_client, invalidator=cache_invalidator)
     data_transformer = DataTransform()
-    state = State(RedisStorage(redis_client=redis_client, state_key="genres_sync"))
 
     try:
         if not elastic_client.indices.exists(index=ELASTIC.GENRES_INDEX):
@@ -94,36 +316,33 @@ def update_genres_index():
         logging.error("🚨 Couldn't connect to elastic!")
         return
 
-    #  Лок, чтобы не допустить наложения задач друг на друга
-    if not redis_client.set(name=GENRES_LOCK_KEY, value=1, nx=True, ex=15):
-        logging.warning("Task already running. Skipping execution.")
-        return
+    with task_lock(GENRES_LOCK_KEY) as lock, sync_state("genres_sync", lock) as state:
+        if not lock:
+            logging.warning("Task already running. Skipping execution.")
+            return
 
-    try:
-        with postgres_connector() as postgres_conn:
-            with closing(postgres_conn.cursor(row_factory=dict_row)) as postgres_cursor:
-                loader = PostgresExtractor(pg_cursor=postgres_cursor)
-                updated_genres = 0
-
-                for batch in loader.extract_genres_data(from_ts=state.get_state(key=GENRES_LAST_CHECK_KEY)):
-                    genres = data_transformer.transform_genres(batch)
-                    uploader.bulk_update_genres(data=genres)
-                    if genres:
-                        state.set_state(key=GENRES_LAST_CHECK_KEY, value=genres[-1].updated_at)
-                    updated_genres += len(genres)
-                    redis_client.expire(GENRES_LOCK_KEY, LOCK_TIMEOUT)
+        full_reindex = state.get_checkpoint(key=GENRES_LAST_CHECK_KEY) is None
+        with postgres_connector() as postgres_conn, loading_mode(uploader, ELASTIC.GENRES_INDEX, full_reindex, budget):
+            with closing(postgres_cursor(postgres_conn, name="genres_extractor")) as pg_cursor:
+                loader = PostgresExtractor(pg_cursor=pg_cursor)
+                updated_genres = EtlPipeline(
+                    transform=data_transformer.transform_genres,
+                    load=uploader.bulk_update_genres,
+                    commit=checkpoint_committer(state, key=GENRES_LAST_CHECK_KEY, lock=lock),
+                    name="genres",
+                    budget=budget,
+                ).run(loader.extract_genres_data(from_checkpoint=state.get_checkpoint(key=GENRES_LAST_CHECK_KEY)))
 
                 logging.info(f"{updated_genres=}")
-    finally:
-        redis_client.delete(GENRES_LOCK_KEY)
+                return updated_genres
 
 
 @shared_task()
-def update_persons_index():
+@adaptive_schedule
+def update_persons_index(budget: RunBudget | None = None):
     """Задача на обновление данных в индексе persons"""
-    uploader = ElasticsearchUploader(elastic_client)
+    uploader = ElasticsearchUploader(elastic_client, invalidator=cache_invalidator)
     data_transformer = DataTransform()
-    state = State(RedisStorage(redis_client=redis_client, state_key="persons_sync"))
 
     try:
         if not elastic_client.indices.exists(index=ELASTIC.PERSONS_INDEX):
@@ -133,25 +352,322 @@ def update_persons_index():
         logging.error("🚨 Couldn't connect to elastic!")
         return
 
-    #  Лок, чтобы не допустить наложения задач друг на друга
-    if not redis_client.set(name=PERSONS_LOCK_KEY, value=1, nx=True, ex=15):
-        logging.warning("Task already running. Skipping execution.")
-        return
+    with task_lock(PERSONS_LOCK_KEY) as lock, sync_state("persons_sync", lock) as state:
+        if not lock:
+            logging.warning("Task already running. Skipping execution.")
+            return
+
+        full_reindex = state.get_checkpoint(key=PERSONS_LAST_CHECK_KEY) is None
+        with postgres_connector() as postgres_conn, loading_mode(uploader, ELASTIC.PERSONS_INDEX, full_reindex, budget):
+            with closing(postgres_cursor(postgres_conn, name="persons_extractor")) as pg_cursor:
+                loader = PostgresExtractor(pg_cursor=pg_cursor)
+                updated_persons = EtlPipeline(
+                    transform=data_transformer.transform_persons,
+                    load=uploader.bulk_update_persons,
+                    commit=checkpoint_committer(state, key=PERSONS_LAST_CHECK_KEY, lock=lock),
+                    name="persons",
+                    budget=budget,
+                ).run(loader.extract_persons_data(from_checkpoint=state.get_checkpoint(key=PERSONS_LAST_CHECK_KEY)))
+
+                logging.info(f"{updated_persons=}")
+                return updated_persons
+
+
+@shared_task()
+@adaptive_schedule
+def sync_content(budget: RunBudget | None = None):
+    """Задача на обновление всех трех индексов одним проходом по изменениям.
+
+    Каждая изменившаяся сущность читается один раз за цикл: фильмы идут в movies,
+    а страница изменившихся жанров (персон) - сразу и в genres (persons), и в жанры
+    (персон) фильмов movies. Курсоры общие для всех индексов, поэтому на каждом
+    сохраненном курсоре индексы согласованы между собой.
+    """
+    uploader = ElasticsearchUploader(elastic_client, invalidator=cache_invalidator)
+    data_transformer = DataTransform()
+    indices = (ELASTIC.MOVIES_INDEX, ELASTIC.GENRES_INDEX, ELASTIC.PERSONS_INDEX)
 
     try:
+        if missing := [index for index in indices if not elastic_client.indices.exists(index=index)]:
+            logging.error(f"🚨 Indices {missing} do not exist!")
+            return
+    except elastic_transport.ConnectionError:
+        logging.error("🚨 Couldn't connect to elastic!")
+        return
+
+    with ExitStack() as stack:
+        locks = [stack.enter_context(task_lock(INDEX_SOURCES[index].lock_key)) for index in indices]
+        if not all(locks):
+            logging.warning("Task already running. Skipping execution.")
+            return
+        state = stack.enter_context(sync_state(CONTENT_STATE_KEY))
+        for lock in locks:
+            state.claim(lock.key, lock.fence)
+
+        seed_from_index_states(state)
+        checkpoints = {
+            key: state.get_checkpoint(key=key)
+            for key in (FILM_WORKS_LAST_CHECK_KEY, GENRES_LAST_CHECK_KEY, PERSONS_LAST_CHECK_KEY)
+        }
+        full_reindex = {
+            ELASTIC.MOVIES_INDEX: checkpoints[FILM_WORKS_LAST_CHECK_KEY] is None,
+            ELASTIC.GENRES_INDEX: checkpoints[GENRES_LAST_CHECK_KEY] is None,
+            ELASTIC.PERSONS_INDEX: checkpoints[PERSONS_LAST_CHECK_KEY] is None,
+        }
+        for index in indices:
+            stack.enter_context(loading_mode(uploader, index, full_reindex[index], budget))
+
+        routes = {
+            ELASTIC.MOVIES_INDEX: (data_transformer.transform_movies, uploader.bulk_update_movies),
+            ELASTIC.GENRES_INDEX: (data_transformer.transform_genres, uploader.bulk_update_genres),
+            ELASTIC.PERSONS_INDEX: (data_transformer.transform_persons, uploader.bulk_update_persons),
+        }
         with postgres_connector() as postgres_conn:
-            with closing(postgres_conn.cursor(row_factory=dict_row)) as postgres_cursor:
-                loader = PostgresExtractor(pg_cursor=postgres_cursor)
-                updated_persons = 0
-
-                for batch in loader.extract_persons_data(from_ts=state.get_state(key=PERSONS_LAST_CHECK_KEY)):
-                    persons = data_transformer.transform_persons(batch)
-                    uploader.bulk_update_persons(data=persons)
-                    if persons:
-                        state.set_state(key=PERSONS_LAST_CHECK_KEY, value=persons[-1].updated_at)
-                    updated_persons += len(persons)
-                    redis_client.expire(PERSONS_LOCK_KEY, LOCK_TIMEOUT)
+            with closing(postgres_cursor(postgres_conn, name="content_extractor")) as pg_cursor:
+                loader = PostgresExtractor(pg_cursor=pg_cursor)
+                updated_films = EtlPipeline(
+                    transform=data_transformer.transform_movies,
+                    load=uploader.bulk_update_movies,
+                    commit=checkpoint_committer(state, key=FILM_WORKS_LAST_CHECK_KEY, lock=locks[0]),
+                    name="movies",
+                    budget=budget,
+                ).run(loader.extract_movies_data(from_checkpoint=checkpoints[FILM_WORKS_LAST_CHECK_KEY]))
 
-                logging.info(f"{updated_persons=}")
-    finally:
-        redis_client.delete(PERSONS_LOCK_KEY)
+                updated_genres = EtlPipeline(
+                    transform=None,
+                    load=None,
+                    commit=checkpoint_committer(state, key=GENRES_LAST_CHECK_KEY, lock=locks[1]),
+                    name="changed_genres",
+                    budget=budget,
+                    routes=routes,
+                ).run(loader.extract_changed_genres(from_checkpoint=checkpoints[GENRES_LAST_CHECK_KEY]))
+
+                updated_persons = EtlPipeline(
+                    transform=None,
+                    load=None,
+                    commit=checkpoint_committer(state, key=PERSONS_LAST_CHECK_KEY, lock=locks[2]),
+                    name="changed_persons",
+                    budget=budget,
+                    routes=routes,
+                ).run(loader.extract_changed_persons(from_checkpoint=checkpoints[PERSONS_LAST_CHECK_KEY]))
+
+                logging.info(f"{updated_films=}, {updated_genres=}, {updated_persons=}")
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Prepared statements: {loader.plan_stats()}")
+                return updated_films + updated_genres + updated_persons
+
+
+# Периодические задачи опроса Postgres в текущем режиме
+POLLING_TASKS = (
+    (sync_content,) if ETL.UNIFIED_SYNC else (update_movies_index, update_genres_index, update_persons_index)
+)
+
+
+@shared_task(bind=True, max_retries=SYNC_MAX_RETRIES)
+def sync_changed_entities(self, changes: dict[str, list[str]]):
+    """Задача на точечное обновление документов по id из ленты изменений Postgres.
+
+    changes - id измененных строк по таблицам: {"film_work": [...], "genre": [...], "person": [...]}.
+    Задача берет те же локи, что и периодические, поэтому не пересекается с ними, а если
+    локи заняты - повторяется через секунду. Состояние периодических задач не двигается:
+    они остаются страховкой на случай потерянных уведомлений.
+    """
+    film_ids, genre_ids, person_ids = (changes.get(table, []) for table in ("film_work", "genre", "person"))
+    passes = [
+        SyncPass(MOVIES_LOCK_KEY, "extract_movies_by_ids", film_ids, "transform_movies", "bulk_update_movies"),
+        SyncPass(
+            MOVIES_LOCK_KEY, "extract_genres_from_films_by_ids", genre_ids, "transform_movies", "bulk_update_movies"
+        ),
+        SyncPass(
+            MOVIES_LOCK_KEY, "extract_persons_from_films_by_ids", person_ids, "transform_movies", "bulk_update_movies"
+        ),
+        SyncPass(GENRES_LOCK_KEY, "extract_genres_by_ids", genre_ids, "transform_genres", "bulk_update_genres"),
+        SyncPass(PERSONS_LOCK_KEY, "extract_persons_by_ids", person_ids, "transform_persons", "bulk_update_persons"),
+    ]
+    passes = [sync_pass for sync_pass in passes if sync_pass.ids]
+    uploader = ElasticsearchUploader(elastic_client, invalidator=cache_invalidator)
+    data_transformer = DataTransform()
+
+    with ExitStack() as locks:
+        lock_keys = dict.fromkeys(sync_pass.lock_key for sync_pass in passes)
+        if not all(locks.enter_context(task_lock(lock_key)) for lock_key in lock_keys):
+            raise self.retry(countdown=1)
+
+        with postgres_connector() as postgres_conn:
+            with closing(postgres_conn.cursor()) as pg_cursor:
+                loader = PostgresExtractor(pg_cursor=pg_cursor)
+                for sync_pass in passes:
+                    updated = EtlPipeline(
+                        transform=getattr(data_transformer, sync_pass.transform),
+                        load=getattr(uploader, sync_pass.load),
+                        commit=lambda checkpoint: None,
+                        name=sync_pass.extract,
+                    ).run(getattr(loader, sync_pass.extract)(sync_pass.ids))
+                    logging.info(f"{sync_pass.extract}: {updated=}")
+
+
+@shared_task()
+def rebuild_index(index: str, shards: int = ETL.REINDEX_SHARDS):
+    """Задача на сборку новой версии индекса и атомарное переключение алиаса на нее.
+
+    Индекс <index>_vN строится с нуля по схеме из es-schemas, пока API и инкрементальная
+    задача продолжают работать со старой версией. Сборка делится на shards диапазонов id,
+    каждый загружает отдельная задача rebuild_shard со своим курсором, так что сборка
+    ускоряется с числом воркеров. Когда все диапазоны загружены, finish_rebuild проверяет
+    новую версию и переключает на нее алиас.
+    """
+    manager = IndexManager(elastic_client)
+    uploader = ElasticsearchUploader(elastic_client)
+    rebuild = RedisStorage(redis_client=redis_client, state_key=f"{index}_rebuild")
+    source = INDEX_SOURCES[index]
+
+    with (
+        task_lock(f"rebuild_{index}_index_lock") as locked,
+        sync_state(f"{index}_rebuild_sync") as state,
+        sync_state(live_state_key(source)) as live_state,
+    ):
+        if not locked:
+            logging.warning("Task already running. Skipping execution.")
+            return
+
+        progress = rebuild.retrieve_state()
+        target = progress.get("target")
+        if not target or not elastic_client.indices.exists(index=target):
+            target = manager.create_next(index)
+            live_snapshot = {key: live_state.storage.retrieve_value(key) for key in source.cursor_keys}
+            progress = {"target": target, "shards": shards, "live_snapshot": live_snapshot}
+            rebuild.save_state(progress)
+            state.storage.save_state({})
+
+        # Прерванная сборка продолжается с тем же разбиением, иначе курсоры диапазонов не совпадут
+        shards = progress.get("shards", 1)
+        uploader.enable_bulk_indexing(target, bulk_settings_backup(target))
+        chord(rebuild_shard.s(index, target, number, shards) for number in range(shards))(
+            finish_rebuild.s(index, target)
+        )
+        logging.info(f"Rebuild of {index} into {target} dispatched in {shards} shards")
+
+
+@shared_task()
+def rebuild_shard(index: str, target: str, number: int, shards: int) -> int | None:
+    """Загружает в target один диапазон id. Возвращает количество документов или None, если не завершена"""
+    source = INDEX_SOURCES[index]
+    uploader = ElasticsearchUploader(elastic_client)
+    data_transformer = DataTransform()
+    lock_key = f"rebuild_{index}_shard_{number}_lock"
+    check_key = f"{source.check_key}_shard_{number}_of_{shards}"
+
+    with task_lock(lock_key) as lock, sync_state(f"{index}_rebuild_sync", lock) as state:
+        if not lock:
+            logging.warning(f"Shard {number} of {index} rebuild already running. Skipping execution.")
+            return None
+
+        with postgres_connector() as postgres_conn:
+            with closing(postgres_cursor(postgres_conn, name=f"{index}_rebuild_{number}")) as pg_cursor:
+                loader = PostgresExtractor(pg_cursor=pg_cursor)
+                return EtlPipeline(
+                    transform=getattr(data_transformer, source.transform),
+                    load=partial(getattr(uploader, source.load), index=target),
+                    commit=checkpoint_committer(state, key=check_key, lock=lock),
+                    name=f"{index}_rebuild",
+                ).run(
+                    getattr(loader, source.extract)(
+                        from_checkpoint=state.get_checkpoint(key=check_key), shard=id_shards(shards)[number]
+                    )
+                )
+
+
+@shared_task()
+def finish_rebuild(results: list[int | None], index: str, target: str):
+    """Проверяет собранную версию индекса и переключает на нее алиас.
+
+    Алиас переключается только если в новой версии не меньше документов, чем исходных
+    записей в Postgres. После переключения курсоры инкрементальной задачи, от которых
+    зависит индекс (IndexSource.cursor_keys), откатываются к моменту начала сборки, чтобы
+    изменения, попавшие за это время только в старую версию, догнали новую. Остальные
+    курсоры общего состояния и fencing-токены не трогаются.
+
+    Chord может завершиться, пока rebuild_index еще держит лок сборки, поэтому лок
+    ожидается, а не пропускается.
+    """
+    source = INDEX_SOURCES[index]
+    manager = IndexManager(elastic_client)
+    uploader = ElasticsearchUploader(elastic_client)
+    rebuild = RedisStorage(redis_client=redis_client, state_key=f"{index}_rebuild")
+
+    with (
+        task_lock(f"rebuild_{index}_index_lock", wait=LOCK_WAIT_TIMEOUT) as locked,
+        sync_state(f"{index}_rebuild_sync") as state,
+    ):
+        if not locked:
+            logging.error(f"🚨 Couldn't acquire rebuild_{index}_index_lock to finish rebuild of {target}!")
+            return
+
+        progress = rebuild.retrieve_state()
+        if progress.get("target") != target:
+            logging.warning(f"Rebuild of {index} into {target} is already finished")
+            return
+        if None in results:
+            logging.error(f"🚨 Not all shards of {target} are loaded. Alias is not switched!")
+            return
+
+        with postgres_connector() as postgres_conn:
+            with closing(postgres_conn.cursor()) as pg_cursor:
+                expected = PostgresExtractor(pg_cursor=pg_cursor).count_source(index)
+
+                indexed = manager.count(target)
+                if indexed < expected:
+                    logging.error(f"🚨 {target} has {indexed} documents, expected {expected}. Alias is not switched!")
+                    return
+
+                # Единственное слияние сегментов сборки: все диапазоны загружены, алиас еще не переключен
+                uploader.restore_index_settings(target, bulk_settings_backup(target))
+
+                shard_checkpoints = [
+                    state.get_checkpoint(key=f"{source.check_key}_shard_{number}_of_{len(results)}")
+                    for number in range(len(results))
+                ]
+                with (
+                    task_lock(source.lock_key, wait=LOCK_WAIT_TIMEOUT) as live_locked,
+                    sync_state(live_state_key(source), live_locked) as live_state,
+                ):
+                    if not live_locked:
+                        logging.error(f"🚨 Couldn't acquire {source.lock_key} to switch {index} alias!")
+                        return
+
+                    manager.swap(index, target)
+                    # Документы новой версии могли измениться все сразу
+                    cache_invalidator.publish(index, None)
+                    snapshot = progress["live_snapshot"]
+                    live_state.restore({key: snapshot.get(key) for key in source.cursor_keys})
+                    # Если инкрементальная задача еще ни разу не работала, она продолжит с курсора,
+                    # до которого собраны все диапазоны
+                    if live_state.get_checkpoint(key=source.check_key) is None and all(shard_checkpoints):
+                        live_state.set_checkpoint(key=source.check_key, value=min(shard_checkpoints))
+                    live_state.flush()
+
+                rebuild.save_state({})
+                state.storage.save_state({})
+                manager.drop_stale(index)
+                logging.info(f"{index} rebuilt into {target}: loaded={sum(results)}, {indexed=}, {expected=}")
+
+
+def rebuild_outdated_indices() -> None:
+    """Ставит в очередь пересборку индексов, собранных по более старой схеме из es-schemas.
+
+    Вызывается при старте beat, то есть при каждом развертывании: после изменения схемы,
+    которое требует заново загрузить документы, индекс пересобирается без ручного запуска
+    rebuild_index. Индексы, пересборка которых уже идет, пропускаются.
+    """
+    manager = IndexManager(elastic_client)
+    for index in INDEX_SOURCES:
+        if RedisStorage(redis_client=redis_client, state_key=f"{index}_rebuild").retrieve_state().get("target"):
+            continue
+        try:
+            outdated = manager.outdated(index)
+        except elastic_transport.ConnectionError:
+            logging.error("🚨 Couldn't connect to elastic!")
+            return
+        if outdated:
+            logging.info(f"{index} was built with an older schema, rebuild is queued")
+            rebuild_index.delay(index)
@@ -7,16 +7,20 @@ from fastapi_cache.decorator import cache
 
 # from core.enums import PermissionEnum
 from api.v1.openapi_schemas import not_found_404
+from core.config import settings
+from core.enums import CacheNamespace
 from dependencies import FilmService, GenreService, get_film_service, get_genre_service
 # from security import get_permissions
 from models.enums import SortOption
+from models.batch import BatchRequest, BatchResult
 from models.film import Film, FilmBase
+from models.page import Page
 
 router = APIRouter(prefix="/films", tags=["films"])
 
 
 @router.get("/search", responses=not_found_404, response_model=list[FilmBase])
-@cache(expire=120)
+@cache(namespace=CacheNamespace.FILMS, expire=settings.LIST_CACHE_EXPIRE)
 async def get_films_by_title(
     title: str = Query(None, max_length=100),
     page_size: int = Query(10, ge=1, le=100),
@@ -35,8 +39,61 @@ async def get_films_by_title(
     return films
 
 
+@router.post("/_batch", response_model=BatchResult[Film])
+async def films_batch(
+    request: BatchRequest,
+    film_service: FilmService = Depends(get_film_service),
+) -> BatchResult[Film]:
+    """
+    Фильмы по списку ID одним запросом. Ненайденные ID возвращаются в missing.
+    """
+    films = await film_service.get_many(request.ids)
+    return BatchResult(
+        items=[films[str(film_id)] for film_id in request.ids if str(film_id) in films],
+        missing=[film_id for film_id in request.ids if str(film_id) not in films],
+    )
+
+
+@router.get("/scroll", responses=not_found_404, response_model=Page[FilmBase])
+async def scroll_films(
+    sort: SortOption = Query(
+        None,
+        description='Choose "-imdb_rating" for descending by film rating' ', "imdb_rating" for ascending',
+    ),
+    genre_id: Optional[UUID] = Query(None, alias="genre"),
+    title: str = Query(None, max_length=100),
+    page_size: int = Query(10, ge=1, le=100),
+    page_token: Optional[str] = Query(None, description="next_page_token предыдущей страницы"),
+    film_service: FilmService = Depends(get_film_service),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Page[FilmBase]:
+    """
+    Листание фильмов по токену страницы, без ограничения глубины.
+    Фильтры и сортировка при листании передаются те же, что и для первой страницы.
+    """
+    films, next_page_token = await film_service.scroll(
+        sort=sort,
+        title=title,
+        genre_id=genre_id,
+        page_size=page_size,
+        page_token=page_token,
+    )
+
+    if not films and not page_token:
+        if genre_id and not await genre_service.get_by_id(genre_id):
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND,
+                detail="genre not found",
+            )
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail="films not found",
+        )
+
+    return Page(items=films, next_page_token=next_page_token)
+
+
 @router.get("/{film_id}", responses=not_found_404, response_model=Film)
-@cache(expire=120)
 async def film_details(
     film_id: UUID,
     # permissions: list[PermissionEnum] = Depends(get_permissions),
@@ -61,7 +118,7 @@ async def film_details(
 
 
 @router.get("/", responses=not_found_404, response_model=list[FilmBase])
-@cache(expire=120)
+@cache(namespace=CacheNamespace.FILMS, expire=settings.LIST_CACHE_EXPIRE)
 async def get_films(
     sort: SortOption = Query(
         None,
@@ -74,24 +131,20 @@ async def get_films(
     genre_service: GenreService = Depends(get_genre_service),
 ):
     """Получить все фильмы"""
-    genre = None
-    if genre_id:
-        genre = await genre_service.get_by_id(genre_id)
-
-        if not genre:
-            raise HTTPException(
-                status_code=HTTPStatus.NOT_FOUND,
-                detail="genre not found",
-            )
-
     films = await film_service.search(
         sort=sort,
-        genres=genre and [genre.name],
+        genre_id=genre_id,
         page_size=page_size,
         page_number=page_number,
     )
 
     if not films:
+        # Жанр читается, только чтобы отличить неизвестный жанр от пустой выдачи
+        if genre_id and not await genre_service.get_by_id(genre_id):
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND,
+                detail="genre not found",
+            )
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail="films not found",
@@ -101,7 +154,7 @@ async def get_films(
 
 
 @router.get("/similar/", responses=not_found_404, response_model=list[FilmBase])
-@cache(expire=120)
+@cache(namespace=CacheNamespace.FILMS, expire=settings.LIST_CACHE_EXPIRE)
 async def get_similar(
     film_id: UUID,
     page_size: int = Query(10, ge=1, le=100),
@@ -132,7 +185,7 @@ async def get_similar(
 
 
 @router.get("/top-genre/", responses=not_found_404, response_model=list[FilmBase])
-@cache(expire=120)
+@cache(namespace=CacheNamespace.FILMS, expire=settings.LIST_CACHE_EXPIRE)
 async def get_top_genres(
     genre_id: UUID = Query(alias="genre"),
     page_size: int = Query(50, ge=1, le=100),
@@ -143,17 +196,15 @@ async def get_top_genres(
     """
     Популярные фильмы в жанре.
     """
-    genre = await genre_service.get_by_id(genre_id)
-    if not genre:
-        raise HTTPException(
-            status_code=HTTPStatus.NOT_FOUND,
-            detail="genre not found",
-        )
-
     films = await film_service.search(
-        sort=SortOption.desc, genres=[genre.name], page_size=page_size, page_number=page_number
+        sort=SortOption.desc, genre_id=genre_id, page_size=page_size, page_number=page_number
     )
     if not films:
+        if not await genre_service.get_by_id(genre_id):
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND,
+                detail="genre not found",
+            )
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="films not found")
 
     return films
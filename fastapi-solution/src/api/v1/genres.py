@@ -4,16 +4,20 @@ from uuid import UUID
 from fastapi import Depends, APIRouter, HTTPException, Query
 from fastapi_cache.decorator import cache
 
+from models.batch import BatchRequest, BatchResult
 from models.genre import Genre
+from models.page import Page
 from services.genre import GenreService
 from api.v1.openapi_schemas import not_found_404
+from core.config import settings
+from core.enums import CacheNamespace
 from dependencies import get_genre_service
 
 router = APIRouter(prefix="/genres", tags=["genres"])
 
 
 @router.get("/", responses=not_found_404, response_model=list[Genre])
-@cache(expire=120)
+@cache(namespace=CacheNamespace.GENRES, expire=settings.LIST_CACHE_EXPIRE)
 async def get_genres(
     title: str | None = Query(None),
     page_size: int = Query(10, ge=1, le=100),
@@ -29,8 +33,38 @@ async def get_genres(
     return genres
 
 
+@router.post("/_batch", response_model=BatchResult[Genre])
+async def genres_batch(
+    request: BatchRequest,
+    genre_service: GenreService = Depends(get_genre_service),
+) -> BatchResult[Genre]:
+    """
+    Жанры по списку ID одним запросом. Ненайденные ID возвращаются в missing.
+    """
+    genres = await genre_service.get_many(request.ids)
+    return BatchResult(
+        items=[genres[str(genre_id)] for genre_id in request.ids if str(genre_id) in genres],
+        missing=[genre_id for genre_id in request.ids if str(genre_id) not in genres],
+    )
+
+
+@router.get("/scroll", responses=not_found_404, response_model=Page[Genre])
+async def scroll_genres(
+    title: str | None = Query(None),
+    page_size: int = Query(10, ge=1, le=100),
+    page_token: str | None = Query(None, description="next_page_token предыдущей страницы"),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> Page[Genre]:
+    """
+    Листание жанров по токену страницы.
+    """
+    genres, next_page_token = await genre_service.scroll(page_size=page_size, page_token=page_token, title=title)
+    if not genres and not page_token:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="genres not found")
+    return Page(items=genres, next_page_token=next_page_token)
+
+
 @router.get("/{genre_id}/", responses=not_found_404, response_model=Genre)
-@cache(expire=120)
 async def genre_details(
     genre_id: UUID,
     genre_service: GenreService = Depends(get_genre_service),
@@ -6,7 +6,11 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi_cache.decorator import cache
 
 from api.v1.openapi_schemas import not_found_404
+from core.config import settings
+from core.enums import CacheNamespace
+from models.batch import BatchRequest, BatchResult
 from models.film import FilmBase
+from models.page import Page
 from models.person import Person
 from models.enums import SortOption
 from dependencies import PersonService, FilmService, get_film_service, get_person_service
@@ -15,7 +19,7 @@ router = APIRouter(prefix="/persons", tags=["persons"])
 
 
 @router.get("/search", response_model=list[Person], responses=not_found_404, response_model_exclude_none=True)
-@cache(expire=120)
+@cache(namespace=CacheNamespace.PERSONS, expire=settings.LIST_CACHE_EXPIRE)
 async def search_persons(
     search_query: Optional[str] = Query(None, alias="query", max_length=100),
     page_size: int = Query(10, ge=1, le=100),
@@ -28,8 +32,36 @@ async def search_persons(
     return persons
 
 
+@router.post("/_batch", response_model=BatchResult[Person])
+async def persons_batch(
+    request: BatchRequest,
+    person_service: PersonService = Depends(get_person_service),
+) -> BatchResult[Person]:
+    persons = await person_service.get_many(request.ids)
+    return BatchResult(
+        items=[persons[str(person_id)] for person_id in request.ids if str(person_id) in persons],
+        missing=[person_id for person_id in request.ids if str(person_id) not in persons],
+    )
+
+
+@router.get(
+    "/search/scroll", response_model=Page[Person], responses=not_found_404, response_model_exclude_none=True
+)
+async def scroll_persons(
+    search_query: Optional[str] = Query(None, alias="query", max_length=100),
+    page_size: int = Query(10, ge=1, le=100),
+    page_token: Optional[str] = Query(None, description="next_page_token предыдущей страницы"),
+    person_service: PersonService = Depends(get_person_service),
+) -> Page[Person]:
+    persons, next_page_token = await person_service.scroll(
+        search_query=search_query, page_size=page_size, page_token=page_token
+    )
+    if not persons and not page_token:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="persons not found")
+    return Page(items=persons, next_page_token=next_page_token)
+
+
 @router.get("/{person_id}", response_model=Person, responses=not_found_404)
-@cache(expire=120)
 async def person_details(
     person_id: UUID,
     person_service: PersonService = Depends(get_person_service),
@@ -41,7 +73,7 @@ async def person_details(
 
 
 @router.get("/{person_id}/film", response_model=list[FilmBase], responses=not_found_404)
-@cache(expire=120)
+@cache(namespace=CacheNamespace.PERSON_FILMS, expire=settings.LIST_CACHE_EXPIRE)
 async def get_person_films(
     person_id: UUID,
     sort: Optional[SortOption] = Query(SortOption.desc, description='Example: "-imdb_rating"'),
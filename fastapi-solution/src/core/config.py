@@ -21,10 +21,25 @@ class Settings(BaseSettings):
     REDIS_HOST: str = Field(alias="REDIS_CACHE_HOST")
     REDIS_PORT: int = Field(alias="REDIS_CACHE_PORT")
 
+    # Кеш сущностей в памяти процесса перед Redis: сколько записей и сколько секунд они живут
+    LOCAL_CACHE_SIZE: int = Field(1024)
+    LOCAL_CACHE_EXPIRE: float = Field(10.0)
+
+    # Канал, в который ETL публикует id измененных документов, и TTL кеша ответов-списков
+    INVALIDATION_CHANNEL: str = Field("content_invalidation")
+    LIST_CACHE_EXPIRE: int = Field(60 * 60)
+
     # Настройки Elasticsearch
     ELASTIC_SCHEMA: str = Field("http")
     ELASTIC_HOST: str = Field("localhost")
     ELASTIC_PORT: int = Field(9200)
+    # Алиасы индексов: ETL переключает их на новую версию индекса после полной пересборки
+    MOVIES_INDEX: str = Field("movies", alias="ELASTIC_MOVIES_INDEX")
+    GENRES_INDEX: str = Field("genres", alias="ELASTIC_GENRES_INDEX")
+    PERSONS_INDEX: str = Field("persons", alias="ELASTIC_PERSONS_INDEX")
+    # Искать фильмы по id жанра и по его имени (terms lookup в индекс жанров) - только на время,
+    # пока rebuild_index не заполнил genre_ids во всех документах movies
+    GENRE_NAME_FALLBACK: bool = Field(False)
 
     AUTH_SERVICE_SCHEMA: str = Field("http")
     AUTH_SERVICE_HOST: str = Field("localhost")
@@ -6,3 +6,12 @@ class PermissionEnum(StrEnum):
     CREATE: str = "CREATE"
     UPDATE: str = "UPDATE"
     DELETE: str = "DELETE"
+
+
+class CacheNamespace(StrEnum):
+    """Пространства имен кеша ответов-списков, сбрасываются при изменении документов индекса"""
+
+    FILMS: str = "films"
+    GENRES: str = "genres"
+    PERSONS: str = "persons"
+    PERSON_FILMS: str = "person-films"
@@ -7,9 +7,14 @@ from fastapi.responses import ORJSONResponse
 from redis.asyncio import Redis
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
+from prometheus_client import make_asgi_app
 
 from api import list_of_routes
 from core.config import settings
+from core.enums import CacheNamespace
+from dependencies import get_film_service, get_genre_service, get_person_service
+from services.invalidation import CacheInvalidationListener
+from services.scroll import InvalidPageToken, PageExpired, TooManyPages
 
 # OpenTelemetry
 from opentelemetry import trace
@@ -28,7 +33,23 @@ async def lifespan(app: FastAPI):
     redis = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
     es = AsyncElasticsearch(hosts=[f"{settings.ELASTIC_SCHEMA}{settings.ELASTIC_HOST}:{settings.ELASTIC_PORT}"])
     await asyncio.to_thread(FastAPICache.init, RedisBackend(redis), "fastapi-cache")
+    # Те же экземпляры сервисов, что получают запросы: зависимости кешируются по (redis, es)
+    invalidation = CacheInvalidationListener(
+        redis,
+        services={
+            settings.MOVIES_INDEX: get_film_service(redis=redis, elastic=es),
+            settings.GENRES_INDEX: get_genre_service(redis=redis, elastic=es),
+            settings.PERSONS_INDEX: get_person_service(redis=redis, elastic=es),
+        },
+        namespaces={
+            settings.MOVIES_INDEX: (CacheNamespace.FILMS, CacheNamespace.PERSON_FILMS),
+            settings.GENRES_INDEX: (CacheNamespace.GENRES,),
+            settings.PERSONS_INDEX: (CacheNamespace.PERSONS, CacheNamespace.PERSON_FILMS),
+        },
+    )
+    invalidation_task = asyncio.create_task(invalidation.run())
     yield {"es": es, "redis": redis}
+    invalidation_task.cancel()
     await redis.close()
     await es.close()
 
@@ -77,6 +98,21 @@ FastAPIInstrumentor.instrument_app(app)
 #         return response
 
 
+@app.exception_handler(InvalidPageToken)
+async def invalid_page_token_handler(request: Request, exc: InvalidPageToken):
+    return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": "invalid page token"})
+
+
+@app.exception_handler(PageExpired)
+async def page_expired_handler(request: Request, exc: PageExpired):
+    return ORJSONResponse(status_code=status.HTTP_410_GONE, content={"detail": "page token expired"})
+
+
+@app.exception_handler(TooManyPages)
+async def too_many_pages_handler(request: Request, exc: TooManyPages):
+    return ORJSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, content={"detail": "too many open pages"})
+
+
 # Подключаем роутер к серверу, указав префикс /v1/films
 # Теги указываем для удобства навигации по документации
 def bind_routes(application: FastAPI) -> None:
@@ -85,3 +121,6 @@ def bind_routes(application: FastAPI) -> None:
 
 
 bind_routes(app)
+
+# Метрики Prometheus (в том числе попадания в кеш сущностей)
+app.mount("/metrics", make_asgi_app())
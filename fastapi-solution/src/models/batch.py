@@ -0,0 +1,20 @@
+from typing import Generic, TypeVar
+from uuid import UUID
+
+from pydantic import BaseModel, Field
+
+T = TypeVar("T")
+
+# Сколько id можно запросить одним пакетным запросом
+BATCH_MAX_IDS = 100
+
+
+class BatchRequest(BaseModel):
+    ids: list[UUID] = Field(..., min_length=1, max_length=BATCH_MAX_IDS)
+
+
+class BatchResult(BaseModel, Generic[T]):
+    # Найденные сущности в порядке запроса
+    items: list[T]
+    # Запрошенные id, которых нет в индексе
+    missing: list[UUID] = Field(default_factory=list)
@@ -0,0 +1,11 @@
+from typing import Generic, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    # Передается в page_token для следующей страницы, None - страниц больше нет
+    next_page_token: Optional[str] = None
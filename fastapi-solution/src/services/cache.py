@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+from prometheus_client import Counter
+from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from core.config import settings
+
+T = TypeVar("T", bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter("api_cache_requests", "Обращения к кешу сущностей", ["entity", "tier", "result"])
+CACHE_COALESCED = Counter(
+    "api_cache_coalesced", "Запросы, дождавшиеся уже идущей загрузки той же сущности", ["entity"]
+)
+
+
+async def delete_matching(redis: Redis, pattern: str, batch_size: int = 500) -> None:
+    """Удаляет ключи по шаблону через SCAN, не блокируя Redis, в отличие от KEYS"""
+    try:
+        batch = []
+        async for key in redis.scan_iter(match=pattern, count=batch_size):
+            batch.append(key)
+            if len(batch) == batch_size:
+                await redis.unlink(*batch)
+                batch = []
+        if batch:
+            await redis.unlink(*batch)
+    except RedisError as e:
+        logger.warning(f"Couldn't delete {pattern} keys in redis: {e}")
+
+
+class LocalCache:
+    """Ограниченный по размеру LRU-кеш в памяти процесса с временем жизни записей."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[object]:
+        if (item := self._items.get(key)) is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: object) -> None:
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+class EntityCache(Generic[T]):
+    """Двухуровневый кеш сущностей: память процесса, затем Redis, затем загрузчик (Elasticsearch).
+
+    Одновременные промахи по одному ключу схлопываются: загрузку выполняет первый запрос,
+    остальные ждут его результат, поэтому истечение популярного фильма дает одно
+    обращение к Elasticsearch, а не по одному на каждый запрос. Недоступность Redis
+    не ломает выдачу - значение просто читается из загрузчика.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        entity: str,
+        model: type[T],
+        expire: int,
+        local_size: int = settings.LOCAL_CACHE_SIZE,
+        local_expire: float = settings.LOCAL_CACHE_EXPIRE,
+    ):
+        self.redis = redis
+        self.entity = entity
+        self.model = model
+        self.expire = expire
+        self._local = LocalCache(max_size=local_size, ttl=local_expire)
+        self._inflight: dict[str, asyncio.Future] = {}
+        # Растет при каждом сбросе: значение, загруженное до сброса, в кеш уже не кладется
+        self._generation = 0
+
+    def key(self, entity_id: str) -> str:
+        return f"{self.entity}:{entity_id}"
+
+    async def get(self, entity_id: str, loader: Callable[[], Awaitable[Optional[T]]]) -> Optional[T]:
+        key = self.key(entity_id)
+        if (value := self._local.get(key)) is not None:
+            CACHE_REQUESTS.labels(entity=self.entity, tier="local", result="hit").inc()
+            return value
+        CACHE_REQUESTS.labels(entity=self.entity, tier="local", result="miss").inc()
+
+        if (loading := self._inflight.get(key)) is not None:
+            CACHE_COALESCED.labels(entity=self.entity).inc()
+            return await asyncio.shield(loading)
+
+        # Загрузка идет отдельной задачей: отмена запроса, который ее начал (например, клиент
+        # отключился), не отменяет ее для остальных ожидающих
+        task = asyncio.ensure_future(self._load(key, loader, self._generation))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    async def get_many(
+        self, entity_ids: list[str], loader: Callable[[list[str]], Awaitable[dict[str, T]]]
+    ) -> dict[str, T]:
+        """Пачка сущностей: из памяти, затем одним MGET из Redis, остальные - одним вызовом loader.
+
+        loader получает недостающие id и возвращает найденные сущности по id. Отсутствующих
+        в результате нет. Загрузки тех же id, уже идущие одиночно или в другой пачке,
+        переиспользуются, а загрузка этой пачки видна одиночным запросам ее id.
+        """
+        found: dict[str, T] = {}
+        inflight: dict[str, asyncio.Future] = {}
+        missing = []
+        for entity_id in dict.fromkeys(entity_ids):
+            key = self.key(entity_id)
+            if (value := self._local.get(key)) is not None:
+                found[entity_id] = value
+            elif (loading := self._inflight.get(key)) is not None:
+                inflight[entity_id] = loading
+            else:
+                missing.append(entity_id)
+        CACHE_REQUESTS.labels(entity=self.entity, tier="local", result="hit").inc(len(found))
+        CACHE_REQUESTS.labels(entity=self.entity, tier="local", result="miss").inc(len(inflight) + len(missing))
+        CACHE_COALESCED.labels(entity=self.entity).inc(len(inflight))
+
+        if missing:
+            batch = asyncio.ensure_future(self._load_many(missing, loader, self._generation))
+            self._register_batch(missing, batch)
+            found.update(await asyncio.shield(batch))
+
+        for entity_id, loading in inflight.items():
+            if (value := await asyncio.shield(loading)) is not None:
+                found[entity_id] = value
+        return found
+
+    def _finish(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ожидающих могло не остаться - помечаем исключение полученным
+        if not task.cancelled():
+            task.exception()
+
+    def _register_batch(self, entity_ids: list[str], batch: asyncio.Future) -> None:
+        """Заводит в _inflight по future на каждый id пачки, которые завершаются вместе с ней"""
+        loop = asyncio.get_running_loop()
+        futures = {entity_id: loop.create_future() for entity_id in entity_ids}
+        for entity_id, future in futures.items():
+            self._inflight[self.key(entity_id)] = future
+
+        def done(task: asyncio.Future) -> None:
+            for entity_id, future in futures.items():
+                key = self.key(entity_id)
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+                if task.cancelled():
+                    future.cancel()
+                elif (error := task.exception()) is not None:
+                    future.set_exception(error)
+                    future.exception()
+                else:
+                    future.set_result(task.result().get(entity_id))
+
+        batch.add_done_callback(done)
+
+    async def invalidate(self, entity_ids: Optional[list[str]] = None) -> None:
+        """Сбрасывает сущности из обоих уровней, entity_ids = None - все сущности этого типа"""
+        self._generation += 1
+        if entity_ids is None:
+            self._local.clear()
+            await delete_matching(self.redis, self.key("*"))
+            return
+
+        keys = [self.key(entity_id) for entity_id in entity_ids]
+        for key in keys:
+            self._local.delete(key)
+        try:
+            await self.redis.unlink(*keys)
+        except RedisError as e:
+            logger.warning(f"Couldn't invalidate {len(keys)} {self.entity} keys in redis: {e}")
+
+    def drop_local(self) -> None:
+        self._generation += 1
+        self._local.clear()
+
+    async def _load(
+        self, key: str, loader: Callable[[], Awaitable[Optional[T]]], generation: int
+    ) -> Optional[T]:
+        value = None
+        try:
+            if (cached := await self.redis.get(key)) is not None:
+                value = self.model.model_validate_json(cached)
+        except RedisError as e:
+            logger.warning(f"Couldn't read {key} from redis: {e}")
+        CACHE_REQUESTS.labels(entity=self.entity, tier="redis", result="miss" if value is None else "hit").inc()
+
+        if value is None and (value := await loader()) is not None and generation == self._generation:
+            try:
+                await self.redis.set(key, value.model_dump_json(by_alias=True), ex=self.expire)
+            except RedisError as e:
+                logger.warning(f"Couldn't write {key} to redis: {e}")
+
+        if value is not None and generation == self._generation:
+            self._local.set(key, value)
+        return value
+
+    async def _load_many(
+        self, entity_ids: list[str], loader: Callable[[list[str]], Awaitable[dict[str, T]]], generation: int
+    ) -> dict[str, T]:
+        found: dict[str, T] = {}
+        try:
+            cached = await self.redis.mget([self.key(entity_id) for entity_id in entity_ids])
+        except RedisError as e:
+            logger.warning(f"Couldn't read {len(entity_ids)} {self.entity} keys from redis: {e}")
+            cached = [None] * len(entity_ids)
+        not_cached = []
+        for entity_id, raw in zip(entity_ids, cached):
+            if raw is None:
+                not_cached.append(entity_id)
+            else:
+                found[entity_id] = self.model.model_validate_json(raw)
+        CACHE_REQUESTS.labels(entity=self.entity, tier="redis", result="hit").inc(len(entity_ids) - len(not_cached))
+        CACHE_REQUESTS.labels(entity=self.entity, tier="redis", result="miss").inc(len(not_cached))
+
+        if not_cached:
+            loaded = await loader(not_cached)
+            found.update(loaded)
+            if loaded and generation == self._generation:
+                try:
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        for entity_id, value in loaded.items():
+                            pipe.set(self.key(entity_id), value.model_dump_json(by_alias=True), ex=self.expire)
+                        await pipe.execute()
+                except RedisError as e:
+                    logger.warning(f"Couldn't write {len(loaded)} {self.entity} keys to redis: {e}")
+
+        if generation == self._generation:
+            for entity_id, value in found.items():
+                self._local.set(self.key(entity_id), value)
+        return found
@@ -4,20 +4,40 @@ from elasticsearch import AsyncElasticsearch, NotFoundError
 from redis.asyncio import Redis
 from uuid import UUID
 
+from core.config import settings
 from models.film import FilmBase, FilmInternal
+from services.cache import EntityCache
+from services.scroll import search_page
 
 
-FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 5
+# Кеш сбрасывается по сообщениям ETL, TTL - только страховка от потерянного сообщения
+FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 60
 
 
 class FilmService:
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
-        self._index = "movies"
+        self._index = settings.MOVIES_INDEX
+        self._cache = EntityCache(redis, "film", FilmInternal, expire=FILM_CACHE_EXPIRE_IN_SECONDS)
+
+    async def invalidate(self, film_ids: Optional[list[str]] = None) -> None:
+        """Сбрасывает кеш сущностей, None - все сущности"""
+        await self._cache.invalidate(film_ids)
+
+    def drop_local_cache(self) -> None:
+        self._cache.drop_local()
 
     async def get_by_id(self, film_id: UUID) -> Optional[FilmInternal]:
-        return await self._get_film_from_elastic(film_id)
+        return await self._cache.get(str(film_id), lambda: self._get_film_from_elastic(film_id))
+
+    async def get_many(self, film_ids: list[UUID]) -> dict[str, FilmInternal]:
+        """Сущности по списку id: сначала из кеша, остальные одним mget. Ненайденных в результате нет."""
+        return await self._cache.get_many([str(film_id) for film_id in film_ids], self._get_films_from_elastic)
+
+    async def _get_films_from_elastic(self, film_ids: list[str]) -> dict[str, FilmInternal]:
+        response = await self.elastic.mget(index=self._index, ids=film_ids)
+        return {doc["_id"]: FilmInternal(**doc["_source"]) for doc in response["docs"] if doc.get("found")}
 
     async def _get_film_from_elastic(self, film_id: UUID) -> Optional[FilmInternal]:
         try:
@@ -32,10 +52,50 @@ class FilmService:
         sort: Optional[str] = None,
         title: Optional[str] = None,
         genres: list[str] = None,
+        genre_id: Optional[UUID] = None,
         films_ids: list[UUID] = None,
         page_size: int = 10,
         page_number: int = 1,
     ) -> list[FilmBase]:
+        response = await self.elastic.search(
+            index=self._index,
+            query=self._query(title=title, genres=genres, genre_id=genre_id, films_ids=films_ids),
+            size=page_size,
+            sort=self._sort(sort),
+            from_=(page_number - 1) * page_size,
+        )
+
+        return [FilmBase(**item["_source"]) for item in response.get("hits", {}).get("hits", [])]
+
+    async def scroll(
+        self,
+        *,
+        sort: Optional[str] = None,
+        title: Optional[str] = None,
+        genres: list[str] = None,
+        genre_id: Optional[UUID] = None,
+        page_size: int = 10,
+        page_token: Optional[str] = None,
+    ) -> tuple[list[FilmBase], Optional[str]]:
+        """Страница фильмов по токену вместо номера страницы"""
+        docs, next_page_token = await search_page(
+            self.elastic,
+            self._index,
+            query=self._query(title=title, genres=genres, genre_id=genre_id),
+            sort=self._sort(sort),
+            page_size=page_size,
+            page_token=page_token,
+        )
+        return [FilmBase(**doc) for doc in docs], next_page_token
+
+    @staticmethod
+    def _query(
+        *,
+        title: Optional[str] = None,
+        genres: list[str] = None,
+        genre_id: Optional[UUID] = None,
+        films_ids: list[UUID] = None,
+    ) -> dict:
         query = {
             "bool": {
                 "must": [],
@@ -46,24 +106,29 @@ class FilmService:
         if genres:
             query["bool"]["filter"].append({"terms": {"genres": genres}})
 
+        if genre_id:
+            # Фильтр по id жанра в том же запросе, без отдельного чтения жанра
+            by_id = {"terms": {"genre_ids": [str(genre_id)]}}
+            if settings.GENRE_NAME_FALLBACK:
+                # Документы, проиндексированные до появления genre_ids, находятся по имени жанра,
+                # которое Elasticsearch сам берет из индекса жанров (terms lookup)
+                genre_lookup = {"index": settings.GENRES_INDEX, "id": str(genre_id), "path": "name"}
+                by_id = {"bool": {"should": [by_id, {"terms": {"genres": genre_lookup}}], "minimum_should_match": 1}}
+            query["bool"]["filter"].append(by_id)
+
         if films_ids:
             query["bool"]["must"].append({"terms": {"id": films_ids}})
 
         if title:
             query["bool"]["must"].append({"match": {"title": title}})
 
+        return query
+
+    @staticmethod
+    def _sort(sort: Optional[str]) -> list[dict]:
         es_sort = []
         if sort:
             order = "desc" if sort.startswith("-") else "asc"
             field = sort.lstrip("-")
             es_sort.append({field: {"order": order}})
-
-        response = await self.elastic.search(
-            index=self._index,
-            query=query or {"match_all": {}},  # if query is {}
-            size=page_size,
-            sort=es_sort,
-            from_=(page_number - 1) * page_size,
-        )
-
-        return [FilmBase(**item["_source"]) for item in response.get("hits", {}).get("hits", [])]
+        return es_sort
@@ -4,17 +4,39 @@ from typing import Optional
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from redis.asyncio import Redis
 
+from core.config import settings
 from models.genre import Genre
+from services.cache import EntityCache
+from services.scroll import search_page
+
+GENRE_CACHE_EXPIRE_IN_SECONDS = 60 * 60
+GENRES_SORT = [{"name.raw": {"order": "asc"}}]
 
 
 class GenreService:
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
-        self._index = "genres"
+        self._index = settings.GENRES_INDEX
+        self._cache = EntityCache(redis, "genre", Genre, expire=GENRE_CACHE_EXPIRE_IN_SECONDS)
+
+    async def invalidate(self, genre_ids: Optional[list[str]] = None) -> None:
+        """Сбрасывает кеш сущностей, None - все сущности"""
+        await self._cache.invalidate(genre_ids)
+
+    def drop_local_cache(self) -> None:
+        self._cache.drop_local()
 
     async def get_by_id(self, genre_id: UUID) -> Optional[Genre]:
-        return await self._get_genre_from_elastic(genre_id)
+        return await self._cache.get(str(genre_id), lambda: self._get_genre_from_elastic(genre_id))
+
+    async def get_many(self, genre_ids: list[UUID]) -> dict[str, Genre]:
+        """Сущности по списку id: сначала из кеша, остальные одним mget. Ненайденных в результате нет."""
+        return await self._cache.get_many([str(genre_id) for genre_id in genre_ids], self._get_genres_from_elastic)
+
+    async def _get_genres_from_elastic(self, genre_ids: list[str]) -> dict[str, Genre]:
+        response = await self.elastic.mget(index=self._index, ids=genre_ids)
+        return {doc["_id"]: Genre(**doc["_source"]) for doc in response["docs"] if doc.get("found")}
 
     async def _get_genre_from_elastic(self, genre_id: UUID) -> Optional[Genre]:
         try:
@@ -28,21 +50,9 @@ class GenreService:
         return result
 
     async def search(self, page_size: int, page_number: int, title = None) -> list[Genre]:
-        if title:
-            query = {
-                "bool": {
-                    "must": [{"match": {"name": title}}],
-                    "filter": []
-                }
-            }
-        else:
-            query = {
-                "match_all": {}
-            }
-
         body = {
-            "query": query,
-            "sort": [{"name.raw": {"order": "asc"}}]
+            "query": self._query(title),
+            "sort": GENRES_SORT
         }
 
         response = await self.elastic.search(
@@ -52,3 +62,30 @@ class GenreService:
             body=body,
         )
         return [Genre(**item["_source"]) for item in response.get("hits", {}).get("hits", [])]
+
+    async def scroll(
+        self, page_size: int, page_token: Optional[str] = None, title=None
+    ) -> tuple[list[Genre], Optional[str]]:
+        """Страница жанров по токену вместо номера страницы"""
+        docs, next_page_token = await search_page(
+            self.elastic,
+            self._index,
+            query=self._query(title),
+            sort=GENRES_SORT,
+            page_size=page_size,
+            page_token=page_token,
+        )
+        return [Genre(**doc) for doc in docs], next_page_token
+
+    @staticmethod
+    def _query(title) -> dict:
+        if title:
+            return {
+                "bool": {
+                    "must": [{"match": {"name": title}}],
+                    "filter": []
+                }
+            }
+        return {
+            "match_all": {}
+        }
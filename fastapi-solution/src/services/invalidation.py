@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Optional, Protocol
+
+from fastapi_cache import FastAPICache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.enums import CacheNamespace
+from services.cache import delete_matching
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд после первого сообщения копить следующие, чтобы сбросить списки один раз на серию
+DEBOUNCE_SECONDS = 0.5
+# Сброс не откладывается дольше этого и не копит больше стольких id, даже если сообщения идут без пауз
+MAX_DEBOUNCE_SECONDS = 2.0
+MAX_PENDING_IDS = 10_000
+RECONNECT_DELAY = 5
+
+
+class CachedService(Protocol):
+    async def invalidate(self, ids: Optional[list[str]] = None) -> None: ...
+
+    def drop_local_cache(self) -> None: ...
+
+
+class CacheInvalidationListener:
+    """Сбрасывает кеши API по сообщениям ETL об измененных документах.
+
+    ETL после каждой загруженной пачки публикует {"index": ..., "ids": [...]} в канал
+    settings.INVALIDATION_CHANNEL. Сущности с этими id сбрасываются из кеша сервиса
+    индекса, а кеш ответов-списков, которые зависят от индекса, сбрасывается целиком,
+    один раз на серию сообщений. Поэтому TTL кешей может быть долгим. Серия копится
+    не дольше MAX_DEBOUNCE_SECONDS и не больше MAX_PENDING_IDS id, поэтому и при
+    непрерывном потоке сообщений кеш сбрасывается регулярно.
+
+    Пока подписки нет, сообщения теряются. Общий кеш в Redis в это время сбрасывают
+    другие экземпляры API, а кеш в памяти процесса после переподключения очищается.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        services: dict[str, CachedService],
+        namespaces: dict[str, tuple[CacheNamespace, ...]],
+        channel: str = settings.INVALIDATION_CHANNEL,
+    ):
+        # Индекс -> сервис его сущностей и пространства имен кеша списков, зависящие от индекса
+        self.redis = redis
+        self.services = services
+        self.namespaces = namespaces
+        self.channel = channel
+
+    async def run(self) -> None:
+        connected_before = False
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    if connected_before:
+                        for service in self.services.values():
+                            service.drop_local_cache()
+                    connected_before = True
+
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+                        changes = defaultdict(set)
+                        deadline = time.monotonic() + MAX_DEBOUNCE_SECONDS
+                        while message is not None:
+                            self._collect(changes, message)
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0 or self._pending(changes) >= MAX_PENDING_IDS:
+                                break
+                            message = await pubsub.get_message(
+                                ignore_subscribe_messages=True, timeout=min(DEBOUNCE_SECONDS, remaining)
+                            )
+                        await self._apply(changes)
+            except RedisError as e:
+                logger.warning(f"Lost cache invalidation channel {self.channel}: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    @staticmethod
+    def _collect(changes: dict[str, set | None], message: dict) -> None:
+        try:
+            payload = json.loads(message["data"])
+            index, ids = payload["index"], payload["ids"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Malformed cache invalidation message: {message['data']!r}")
+            return
+        # None - изменился весь индекс
+        if ids is None or changes.get(index, set()) is None:
+            changes[index] = None
+        else:
+            changes[index].update(ids)
+
+    @staticmethod
+    def _pending(changes: dict[str, set | None]) -> int:
+        return sum(len(ids) for ids in changes.values() if ids is not None)
+
+    async def _apply(self, changes: dict[str, set | None]) -> None:
+        namespaces = set()
+        for index, ids in changes.items():
+            if (service := self.services.get(index)) is None:
+                continue
+            await service.invalidate(None if ids is None else list(ids))
+            namespaces.update(self.namespaces.get(index, ()))
+
+        for namespace in namespaces:
+            await delete_matching(self.redis, f"{FastAPICache.get_prefix()}:{namespace}:*")
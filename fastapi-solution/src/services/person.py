@@ -4,19 +4,38 @@ from uuid import UUID
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from redis.asyncio import Redis
 
+from core.config import settings
 from models.person import Person
+from services.cache import EntityCache
+from services.scroll import search_page
 
-PERSON_CACHE_EXPIRE_IN_SECONDS = 60 * 5
+PERSON_CACHE_EXPIRE_IN_SECONDS = 60 * 60
 
 
 class PersonService:
     def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
         self.redis = redis
         self.elastic = elastic
-        self._index = "persons"
+        self._index = settings.PERSONS_INDEX
+        self._cache = EntityCache(redis, "person", Person, expire=PERSON_CACHE_EXPIRE_IN_SECONDS)
+
+    async def invalidate(self, person_ids: Optional[list[str]] = None) -> None:
+        """Сбрасывает кеш сущностей, None - все сущности"""
+        await self._cache.invalidate(person_ids)
+
+    def drop_local_cache(self) -> None:
+        self._cache.drop_local()
 
     async def get_by_id(self, person_id: UUID) -> Optional[Person]:
-        return await self._get_person_from_elastic(person_id)
+        return await self._cache.get(str(person_id), lambda: self._get_person_from_elastic(person_id))
+
+    async def get_many(self, person_ids: list[UUID]) -> dict[str, Person]:
+        """Сущности по списку id: сначала из кеша, остальные одним mget. Ненайденных в результате нет."""
+        return await self._cache.get_many([str(person_id) for person_id in person_ids], self._get_persons_from_elastic)
+
+    async def _get_persons_from_elastic(self, person_ids: list[str]) -> dict[str, Person]:
+        response = await self.elastic.mget(index=self._index, ids=person_ids)
+        return {doc["_id"]: Person(**doc["_source"]) for doc in response["docs"] if doc.get("found")}
 
     async def _get_person_from_elastic(self, person_id: UUID) -> Optional[Person]:
         try:
@@ -26,16 +45,26 @@ class PersonService:
             return None
 
     async def search(self, *, page_size: int, page_number: int, search_query: str = None) -> list[Person]:
-        query = {}
-
-        if search_query:
-            query["match"] = {"full_name": search_query}
-
         response = await self.elastic.search(
             index=self._index,
             size=page_size,
             from_=(page_number - 1) * page_size,
-            query=query or {"match_all": {}},  # if query is {}
+            query=self._query(search_query),
         )
 
         return [Person(**item["_source"]) for item in response.get("hits", {}).get("hits", [])]
+
+    async def scroll(
+        self, *, page_size: int, page_token: Optional[str] = None, search_query: str = None
+    ) -> tuple[list[Person], Optional[str]]:
+        """Страница персон по токену вместо номера страницы"""
+        docs, next_page_token = await search_page(
+            self.elastic, self._index, query=self._query(search_query), page_size=page_size, page_token=page_token
+        )
+        return [Person(**doc) for doc in docs], next_page_token
+
+    @staticmethod
+    def _query(search_query: Optional[str]) -> dict:
+        if search_query:
+            return {"match": {"full_name": search_query}}
+        return {"match_all": {}}
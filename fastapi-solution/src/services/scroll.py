@@ -0,0 +1,117 @@
+import base64
+import binascii
+import json
+import time
+from collections import deque
+from typing import Any, Optional
+
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+# Сколько живет point-in-time между запросами соседних страниц. Брошенные клиентом PIT
+# закрывает только истечение этого срока, поэтому он короткий
+PIT_KEEP_ALIVE_SECONDS = 30
+PIT_KEEP_ALIVE = f"{PIT_KEEP_ALIVE_SECONDS}s"
+# Сколько PIT процесс может открыть за PIT_KEEP_ALIVE_SECONDS: при отсутствии закрытий это
+# верхняя граница открытых им PIT, которая держит кластер ниже search.max_open_point_in_time_context
+MAX_OPENED_PITS = 500
+
+
+class InvalidPageToken(Exception):
+    """Токен страницы не удалось разобрать."""
+
+
+class PageExpired(Exception):
+    """Point-in-time токена закрыт или истек, листание нужно начать заново."""
+
+
+class TooManyPages(Exception):
+    """Открыто слишком много point-in-time, новое листание нужно начать позже."""
+
+
+# Время открытия PIT этим процессом за последние PIT_KEEP_ALIVE_SECONDS
+_opened_pits: deque[float] = deque()
+
+
+def _reserve_pit() -> None:
+    now = time.monotonic()
+    while _opened_pits and _opened_pits[0] <= now - PIT_KEEP_ALIVE_SECONDS:
+        _opened_pits.popleft()
+    if len(_opened_pits) >= MAX_OPENED_PITS:
+        raise TooManyPages()
+    _opened_pits.append(now)
+
+
+def encode_page_token(pit_id: str, search_after: list[Any]) -> str:
+    payload = json.dumps({"pit": pit_id, "after": search_after}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_page_token(token: str) -> tuple[str, list[Any]]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return payload["pit"], payload["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidPageToken(token) from e
+
+
+async def search_page(
+    elastic: AsyncElasticsearch,
+    index: str,
+    *,
+    query: dict,
+    sort: Optional[list] = None,
+    page_size: int,
+    page_token: Optional[str] = None,
+) -> tuple[list[dict], Optional[str]]:
+    """Страница выдачи через point-in-time и search_after.
+
+    Первая страница открывает point-in-time - снимок индекса, по которому листается
+    вся выдача, следующие продолжают с сортировочных значений последнего документа
+    из токена (без явной сортировки - по релевантности). Поэтому любая страница стоит
+    как первая, а не O(from + size), и нет ограничения max_result_window. Elasticsearch
+    сам добавляет к сортировке по PIT уникальный _shard_doc, так что документы с равными
+    значениями не теряются.
+
+    Последняя (неполная или пустая) страница закрывает point-in-time. Новые листания
+    ограничены MAX_OPENED_PITS за время жизни PIT (иначе TooManyPages).
+
+    Возвращает документы страницы и токен следующей (None на последней странице).
+    """
+    if page_token:
+        pit_id, search_after = decode_page_token(page_token)
+    else:
+        _reserve_pit()
+        pit_id, search_after = (await elastic.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"], None
+
+    try:
+        response = await elastic.search(
+            pit={"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+            query=query,
+            sort=sort or ["_score"],
+            size=page_size,
+            search_after=search_after,
+            track_total_hits=False,
+        )
+    except NotFoundError as e:
+        raise PageExpired(page_token) from e
+    except Exception:
+        # Первая страница не отдала токен, и PIT никто больше не продолжит
+        if not page_token:
+            await _close_pit(elastic, pit_id)
+        raise
+
+    hits = response["hits"]["hits"]
+    # Elasticsearch может вернуть новый id для того же point-in-time
+    pit_id = response.get("pit_id", pit_id)
+    if len(hits) < page_size:
+        await _close_pit(elastic, pit_id)
+        return [hit["_source"] for hit in hits], None
+
+    return [hit["_source"] for hit in hits], encode_page_token(pit_id, hits[-1]["sort"])
+
+
+async def _close_pit(elastic: AsyncElasticsearch, pit_id: str) -> None:
+    try:
+        await elastic.close_point_in_time(id=pit_id)
+    except NotFoundError:
+        pass